@@ -4,7 +4,7 @@ import pandas as pd
 from pathlib import Path
 from dataclasses import dataclass, asdict
 from typing import List, Dict, Any, Optional
-from structures import Fixation
+from structures import Fixations
 import sqlite3
 
 WORLD_TS_COL = "timestamp [ns]"          
@@ -13,11 +13,15 @@ FIX_END_COL = "end timestamp [ns]"       # fin fixation
 FIX_X_COL = "fixation x [px]"            # coordonnée x du regard 
 FIX_Y_COL = "fixation y [px]"            # coordonnée y du regard 
 FIX_X_IS_NORMALIZED = False              # True si x,y ∈ [0,1], False si déjà en pixels
+GAZE_TS_COL = "timestamp [ns]"
+GAZE_X_COL = "gaze x [px]"
+GAZE_Y_COL = "gaze y [px]"
 DB_PATH = "database.sqlite"
 WORLD_TS = "world_timestamps"
+FETCH_ROWS = 65_536  # lignes lues par lot par load_columns
 
 
-def load_from_db(db_path: str, cols: List[str], table: str) -> np.ndarray:
+def load_from_db(db_path: str, cols: List[str], table: str) -> List[tuple]:
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
 
@@ -29,40 +33,96 @@ def load_from_db(db_path: str, cols: List[str], table: str) -> np.ndarray:
         FROM {table}""")
     
     rows = cursor.fetchall()
-    arr = np.array(rows)
     conn.close()
 
     return rows
 
-def load_fixations_db(db_path: str) -> List[Fixation]:
+def column_dtype(col: str) -> np.dtype:
+    """Type NumPy d'une colonne : int64 pour les timestamps en ns et les indices, float32 pour les coordonnées en px"""
+    if col.endswith("[ns]") or col.endswith("[idx]"):
+        return np.dtype(np.int64)
+    if col.endswith("[px]"):
+        return np.dtype(np.float32)
+    return np.dtype(np.float64)
+
+def load_columns(db_path: str, cols: List[str], table: str,
+                 where: str = "", params: tuple = (), order_by: Optional[str] = None) -> Dict[str, np.ndarray]:
+    """
+    Charge des colonnes sous forme de tableaux NumPy typés (un tableau par colonne).
+    Les lignes sont lues par lots de FETCH_ROWS : seul le lot courant existe en tuples Python.
+    where / params : clause SQL optionnelle (ex: '"timestamp [ns]" >= ?'), avec ses paramètres
+    """
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
 
-    cursor.execute(f"""
-        SELECT
-            {FIX_START_COL},
-            {FIX_END_COL},
-            {FIX_X_COL},
-            {FIX_Y_COL}
-        FROM fixations
-        ORDER BY {FIX_START_COL} ASC;
-                   """)
+    cols_escaped = ', '.join([f'"{col}"' for col in cols])
+    query = f"SELECT {cols_escaped} FROM {table}"
+    if where:
+        query += f" WHERE {where}"
+    if order_by is not None:
+        query += f' ORDER BY "{order_by}" ASC'
 
-    rows = cursor.fetchall()
+    cursor.execute(query, params)
+    parts = {col: [] for col in cols}
+    while True:
+        rows = cursor.fetchmany(FETCH_ROWS)
+        if not rows:
+            break
+        for col, values in zip(cols, zip(*rows)):
+            parts[col].append(np.fromiter(values, dtype=column_dtype(col), count=len(rows)))
     conn.close()
 
-    fixations: List[Fixation] = []
-    for i, row in enumerate(rows):
-        fix = Fixation(
-            fixation_id=i,
-            start=float(row[0]),
-            end=float(row[1]),
-            x=float(row[2]),
-            y=float(row[3]),
-        )
-        fixations.append(fix)
+    return {
+        col: np.concatenate(chunks) if chunks else np.empty(0, dtype=column_dtype(col))
+        for col, chunks in parts.items()
+    }
+
+def load_fixations_arrays(db_path: str, table: str = "fixations", where: str = "", params: tuple = ()) -> Dict[str, np.ndarray]:
+    """Fixations triées par début, en colonnes : start, end (int64 ns), x, y (float32 px)"""
+    arrays = load_columns(
+        db_path, [FIX_START_COL, FIX_END_COL, FIX_X_COL, FIX_Y_COL], table,
+        where=where, params=params, order_by=FIX_START_COL,
+    )
+    return {
+        "start": arrays[FIX_START_COL],
+        "end": arrays[FIX_END_COL],
+        "x": arrays[FIX_X_COL],
+        "y": arrays[FIX_Y_COL],
+    }
+
+def fixations_between(db_path: str, t0: int, t1: int, table: str = "fixations") -> Dict[str, np.ndarray]:
+    """
+    Fixations qui commencent dans [t0, t1[ (timestamps en ns).
+    Utilise l'index sur la colonne de début créé par csv_to_sqlite.
+    """
+    return load_fixations_arrays(
+        db_path, table,
+        where=f'"{FIX_START_COL}" >= ? AND "{FIX_START_COL}" < ?', params=(int(t0), int(t1)),
+    )
+
+def load_gaze_arrays(db_path: str, table: str = "gaze", where: str = "", params: tuple = ()) -> Dict[str, np.ndarray]:
+    """Échantillons de regard triés par timestamp, en colonnes : ts (int64 ns), x, y (float32 px)"""
+    arrays = load_columns(
+        db_path, [GAZE_TS_COL, GAZE_X_COL, GAZE_Y_COL], table,
+        where=where, params=params, order_by=GAZE_TS_COL,
+    )
+    return {
+        "ts": arrays[GAZE_TS_COL],
+        "x": arrays[GAZE_X_COL],
+        "y": arrays[GAZE_Y_COL],
+    }
+
+def gaze_between(db_path: str, t0: int, t1: int, table: str = "gaze") -> Dict[str, np.ndarray]:
+    """Échantillons de regard dans [t0, t1[ (timestamps en ns), via l'index sur le timestamp"""
+    return load_gaze_arrays(
+        db_path, table,
+        where=f'"{GAZE_TS_COL}" >= ? AND "{GAZE_TS_COL}" < ?', params=(int(t0), int(t1)),
+    )
 
-    return fixations
+def load_fixations_db(db_path: str) -> Fixations:
+    """Fixations en tableau structuré (itérer dessus donne des Fixation)"""
+    arrays = load_fixations_arrays(db_path)
+    return Fixations.from_columns(fixation_id=np.arange(len(arrays["start"])), **arrays)
 
 
 # Usage Example
@@ -70,3 +130,4 @@ def load_fixations_db(db_path: str) -> List[Fixation]:
 # fixation_data = load_from_db(DB_PATH, 
 #                              [FIX_START_COL, FIX_END_COL, FIX_X_COL, FIX_Y_COL], 
 #                              "fixations")
+# fixations = fixations_between(DB_PATH, t0, t0 + 10_000_000_000)  # 10 premières secondes
@@ -0,0 +1,320 @@
+import cv2
+import csv
+import json
+import time
+import platform
+import tempfile
+import numpy as np
+from pathlib import Path
+from typing import Dict, Any
+
+from convert_to_sql import csv_to_sqlite
+from frame_index import build_alignment
+from appelsDB import load_fixations_arrays, WORLD_TS_COL
+from ptsInteretPosterImages import load_posters, POSTERS_DIR
+from ptsInteretFixations import sample_frames, extract_features, SIFT_on_fixations
+from undistort import Undistorter
+from match_images import PosterIndex, PosterTracker, FEATURE_BACKENDS, BACKEND_CROP_SIZES, create_detector
+from heat_map import heat_map_density
+from track_heatmap import DecayingHeatmap, make_gaussian_kernel, KERNEL_SIZE, HEAT_INTENSITY
+
+# Benchmark headless sur données synthétiques (aucune fenêtre, aucune donnée de sujet requise)
+OUTPUT_JSON = "output/benchmark.json"
+OUTPUT_BACKENDS_JSON = "output/backend_comparison.json"
+
+SCENE_W, SCENE_H = 1600, 1200
+FPS = 30
+N_FRAMES = 300
+GAZE_HZ = 200
+FIXATION_PERIOD_MS = 300
+FIXATION_DURATION_MS = 200
+CROP_SIZE = 100
+N_DENSITY_POINTS = 20_000
+T0_NS = 1_700_000_000_000_000_000
+
+
+class StageTimer:
+    """Chronomètre les étapes et garde les résultats pour le JSON"""
+    def __init__(self):
+        self.stages: Dict[str, Dict[str, Any]] = {}
+
+    def time(self, name, fn, *args, count=None, **kwargs):
+        t = time.perf_counter()
+        result = fn(*args, **kwargs)
+        elapsed = time.perf_counter() - t
+        n = count(result) if callable(count) else count
+        self.stages[name] = {"seconds": elapsed}
+        if n is not None:
+            self.stages[name]["count"] = n
+            self.stages[name]["per_second"] = n / elapsed if elapsed > 0 else None
+        print(f"{name:>18} : {elapsed * 1000:9.1f} ms" + (f"  ({n})" if n is not None else ""))
+        return result
+
+
+def poster_homographies(n_frames, poster_size, rng):
+    """Homographie poster -> scène par frame : affiche qui dérive lentement avec une légère perspective"""
+    pw, ph = poster_size
+    scale = 0.6 * SCENE_H / ph
+    homographies = []
+    for i in range(n_frames):
+        dx = 300 + 80 * np.sin(i / 40) + rng.normal(0, 1)
+        dy = 150 + 40 * np.cos(i / 55) + rng.normal(0, 1)
+        tilt = 2e-5 * np.sin(i / 70)
+        homographies.append(np.array([
+            [scale, 0.0, dx],
+            [0.0, scale, dy],
+            [tilt, 0.0, 1.0],
+        ]))
+    return homographies
+
+
+def generate_subject(folder: Path, poster_path: Path, n_frames=N_FRAMES, seed=0):
+    """
+    Crée un sujet synthétique au format des exports : vidéo de scène avec une affiche
+    projetée dedans, gaze.csv, fixations.csv, world_timestamps.csv et scene_camera.json.
+    """
+    rng = np.random.default_rng(seed)
+    folder.mkdir(parents=True, exist_ok=True)
+    poster = cv2.imread(str(poster_path), cv2.IMREAD_COLOR)
+    ph, pw = poster.shape[:2]
+    homographies = poster_homographies(n_frames, (pw, ph), rng)
+
+    video_path = folder / "scene.mp4"
+    out = cv2.VideoWriter(str(video_path), cv2.VideoWriter_fourcc(*"mp4v"), FPS, (SCENE_W, SCENE_H))
+    background = rng.integers(60, 120, (SCENE_H, SCENE_W, 3), dtype=np.uint8)
+    for H in homographies:
+        frame = background.copy()
+        cv2.warpPerspective(poster, H, (SCENE_W, SCENE_H), dst=frame, borderMode=cv2.BORDER_TRANSPARENT)
+        out.write(frame)
+    out.release()
+
+    frame_ts = T0_NS + (np.arange(n_frames) * 1e9 / FPS).astype(np.int64)
+    with open(folder / "world_timestamps.csv", "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["section id", "recording id", WORLD_TS_COL])
+        w.writerows(["s", "r", int(t)] for t in frame_ts)
+
+    # Regard : marche aléatoire en coordonnées affiche, projetée dans la scène
+    n_gaze = int(n_frames / FPS * GAZE_HZ)
+    gaze_ts = T0_NS + (np.arange(n_gaze) * 1e9 / GAZE_HZ).astype(np.int64)
+    walk = np.cumsum(rng.normal(0, 15, (n_gaze, 2)), axis=0) + (pw / 2, ph / 2)
+    walk = np.clip(walk, (0.1 * pw, 0.1 * ph), (0.9 * pw, 0.9 * ph))
+    frame_of_gaze = np.minimum(((gaze_ts - T0_NS) / 1e9 * FPS).astype(int), n_frames - 1)
+    gaze_xy = np.empty_like(walk)
+    for i in range(n_frames):
+        sel = frame_of_gaze == i
+        if sel.any():
+            gaze_xy[sel] = cv2.perspectiveTransform(walk[sel].reshape(-1, 1, 2), homographies[i]).reshape(-1, 2)
+
+    with open(folder / "gaze.csv", "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["section id", "recording id", "timestamp [ns]", "gaze x [px]", "gaze y [px]"])
+        w.writerows(["s", "r", int(t), float(x), float(y)] for t, (x, y) in zip(gaze_ts, gaze_xy))
+
+    with open(folder / "fixations.csv", "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["section id", "recording id", "fixation id", "start timestamp [ns]",
+                    "end timestamp [ns]", "duration [ms]", "fixation x [px]", "fixation y [px]"])
+        start = T0_NS
+        fixation_id = 1
+        while start + FIXATION_DURATION_MS * 1_000_000 < gaze_ts[-1]:
+            end = start + FIXATION_DURATION_MS * 1_000_000
+            sel = (gaze_ts >= start) & (gaze_ts < end)
+            x, y = gaze_xy[sel].mean(axis=0)
+            w.writerow(["s", "r", fixation_id, start, end, FIXATION_DURATION_MS, float(x), float(y)])
+            start += FIXATION_PERIOD_MS * 1_000_000
+            fixation_id += 1
+
+    K = [[SCENE_W * 0.55, 0.0, SCENE_W / 2], [0.0, SCENE_W * 0.55, SCENE_H / 2], [0.0, 0.0, 1.0]]
+    with open(folder / "scene_camera.json", "w") as f:
+        json.dump({"camera_matrix": K, "distortion_coefficients": [[0.0] * 8]}, f)
+
+    return video_path
+
+
+def run_benchmarks(output_json=OUTPUT_JSON, n_frames=N_FRAMES, seed=0) -> Dict[str, Any]:
+    timer = StageTimer()
+    poster_path = sorted(Path(POSTERS_DIR).glob("*.png"))[0]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = Path(tmp) / "sujet_synthetique"
+        db_path = str(Path(tmp) / "database.sqlite")
+        video_path = timer.time("generate", generate_subject, folder, poster_path, n_frames, seed)
+
+        timer.time("csv_import", csv_to_sqlite, str(folder), db_path, verbose=False)
+
+        fixations = load_fixations_arrays(db_path)
+        alignment = timer.time("alignment", build_alignment, db_path)
+        mid_ts = (fixations["start"] + fixations["end"]) // 2
+        mid_frames = alignment["fix_mid_frame"]
+        targets = [(i, int(f)) for i, f in enumerate(mid_frames)]
+
+        def decode():
+            cap = cv2.VideoCapture(str(video_path))
+            frames = [(i, frame) for i, frame in sample_frames(cap, targets)]
+            cap.release()
+            return frames
+        frames = timer.time("decode", decode, count=len)
+
+        with open(folder / "scene_camera.json") as f:
+            calib = json.load(f)
+        K = np.array(calib["camera_matrix"], dtype=np.float64)
+        D = np.array(calib["distortion_coefficients"], dtype=np.float64).reshape(-1)
+        undistorter = timer.time("undistort_maps", Undistorter, K, D, (SCENE_W, SCENE_H))
+
+        timer.time("undistort_full", lambda: [undistorter.frame(frame) for _, frame in frames], count=len)
+
+        def crop_all():
+            crops = []
+            for i, frame in frames:
+                cx, cy = undistorter.points([(fixations["x"][i], fixations["y"][i])])[0].astype(int)
+                window = undistorter.crop_around(frame, cx, cy, CROP_SIZE)
+                if window is None:
+                    continue
+                crop, (x0, y0, _, _) = window
+                crops.append(((i, (x0, y0)), crop))
+            return crops
+        crops = timer.time("undistort_roi", crop_all, count=len)
+
+        features = timer.time("sift", lambda: list(extract_features(crops)), count=len)
+
+        # Cache des affiches dans le dossier temporaire (pas le cache partagé) : extraction à froid,
+        # puis relecture du cache, mesurées séparément
+        cache_dir = str(Path(tmp) / "cache")
+        timer.time("load_posters_cold", load_posters, POSTERS_DIR, cv2.SIFT_create(), cache_dir, count=len)
+        posters = timer.time("load_posters_warm", load_posters, POSTERS_DIR, cv2.SIFT_create(), cache_dir, count=len)
+        index = timer.time("index_build", PosterIndex.from_posters, posters)
+
+        entries = [{
+            "fix_index": i, "frame_num": int(mid_frames[i]), "timestamp": int(mid_ts[i]),
+            "x": float(fixations["x"][i]), "y": float(fixations["y"][i]), "crop_origin": origin,
+            "keypoints": kp, "descriptors": des,
+        } for (i, origin), kp, des in features if len(kp) > 0]
+
+        def match():
+            tracker = PosterTracker(index, posters)
+            return [r for r in (tracker.match(e) for e in entries) if r is not None]
+        detections = timer.time("matching", match, count=len(entries))
+        correct = sum(d.poster_name == poster_path.name for d, _ in detections)
+
+        # Densité et rendu sur des points aléatoires
+        rng = np.random.default_rng(seed)
+        pw, ph = posters[0].size
+        px = rng.uniform(0, pw, N_DENSITY_POINTS)
+        py = rng.uniform(0, ph, N_DENSITY_POINTS)
+        timer.time("density", heat_map_density, px, py, pw, ph, 300, count=N_DENSITY_POINTS)
+
+        def render():
+            heatmap = DecayingHeatmap(SCENE_W, SCENE_H, make_gaussian_kernel(KERNEL_SIZE, HEAT_INTENSITY))
+            frame = np.zeros((SCENE_H, SCENE_W, 3), dtype=np.uint8)
+            for _ in range(n_frames):
+                heatmap.decay()
+                for gx, gy in rng.uniform((1, 1), (SCENE_W - 1, SCENE_H - 1), (GAZE_HZ // FPS, 2)).astype(int):
+                    heatmap.add(gx, gy)
+                heatmap.render(frame)
+        timer.time("rendering", render, count=n_frames)
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+        },
+        "parameters": {
+            "scene_size": [SCENE_W, SCENE_H], "fps": FPS, "n_frames": n_frames, "gaze_hz": GAZE_HZ,
+            "n_fixations": len(targets), "crop_size": CROP_SIZE, "seed": seed,
+            "poster": poster_path.name,
+        },
+        "detections": {"total": len(detections), "correct_poster": correct, "fixations": len(entries)},
+        "stages": timer.stages,
+    }
+
+    Path(output_json).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_json, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Rapport écrit dans {output_json}")
+    return report
+
+
+def compare_backends(backends=tuple(FEATURE_BACKENDS), output_json=OUTPUT_BACKENDS_JSON,
+                     n_frames=N_FRAMES, seed=0) -> Dict[str, Any]:
+    """
+    Compare les détecteurs sur le même sujet synthétique : temps d'extraction + matching,
+    détections correctes (vérité terrain connue : toutes les fixations sont sur l'affiche),
+    rappel sur l'ensemble des fixations et accord avec la référence SIFT.
+    Chaque backend utilise sa taille de crop (BACKEND_CROP_SIZES).
+    """
+    poster_path = sorted(Path(POSTERS_DIR).glob("*.png"))[0]
+    results: Dict[str, Any] = {}
+    detections_by_backend = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = Path(tmp) / "sujet_synthetique"
+        db_path = str(Path(tmp) / "database.sqlite")
+        video_path = generate_subject(folder, poster_path, n_frames, seed)
+        csv_to_sqlite(str(folder), db_path, verbose=False)
+        n_fixations = len(load_fixations_arrays(db_path)["start"])
+
+        for backend in backends:
+            try:
+                detector = create_detector(backend)
+            except RuntimeError as e:
+                print(f"{backend} ignoré : {e}")
+                continue
+
+            posters = load_posters(POSTERS_DIR, detector, cache_dir=str(Path(tmp) / "cache"))
+            index = PosterIndex.from_posters(posters)
+
+            t = time.perf_counter()
+            entries = SIFT_on_fixations(str(folder), db_path, video_path.name, backend=backend)
+            t_features = time.perf_counter() - t
+
+            t = time.perf_counter()
+            tracker = PosterTracker(index, posters)
+            detections = [r[0] for r in (tracker.match(e) for e in entries) if r is not None]
+            t_matching = time.perf_counter() - t
+
+            detections_by_backend[backend] = {d.fixation_id: d.poster_name for d in detections}
+            correct = sum(d.poster_name == poster_path.name for d in detections)
+            results[backend] = {
+                "crop_size": BACKEND_CROP_SIZES[backend],
+                "features_s": t_features,
+                "matching_s": t_matching,
+                "total_s": t_features + t_matching,
+                "fixations_with_features": len(entries),
+                "detections": len(detections),
+                "correct_poster": correct,
+                "recall": correct / n_fixations if n_fixations else None,
+                "mean_keypoints_per_poster": float(np.mean([len(p.kp) for p in posters])),
+            }
+
+    # Comparaison avec la référence SIFT : rappel relatif et accord sur l'affiche
+    reference = detections_by_backend.get("sift")
+    for backend, stats in results.items():
+        if reference is None:
+            break
+        found = detections_by_backend[backend]
+        common = set(reference) & set(found)
+        stats["recall_vs_sift"] = len(common) / len(reference) if reference else None
+        stats["agreement_vs_sift"] = (
+            sum(reference[f] == found[f] for f in common) / len(common) if common else None
+        )
+        stats["speedup_vs_sift"] = results["sift"]["total_s"] / stats["total_s"] if stats["total_s"] > 0 else None
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "parameters": {"n_frames": n_frames, "seed": seed, "poster": poster_path.name},
+        "backends": results,
+    }
+    Path(output_json).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_json, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(results, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    run_benchmarks()
+    # compare_backends()
@@ -3,6 +3,21 @@ import os
 import csv
 import sqlite3
 import argparse
+from itertools import chain, islice
+
+# Rows per executemany() call
+CHUNK_SIZE = 50_000
+# Rows scanned to infer column types
+TYPE_SAMPLE_SIZE = 1_000
+# Columns indexed after loading (when present in the CSV)
+INDEX_COLUMNS = ["timestamp [ns]", "start timestamp [ns]"]
+# Pragmas for bulk loading (the database can always be rebuilt from the CSVs)
+BULK_PRAGMAS = {
+    "journal_mode": "MEMORY",
+    "synchronous": "OFF",
+    "cache_size": -200_000,  # in KiB (~200 MB)
+    "temp_store": "MEMORY",
+}
 
 def infer_type(value):
     """Infer SQLite column type from string contents."""
@@ -23,32 +38,93 @@ def infer_type(value):
     return "TEXT"
 
 
-def create_table_from_csv(cursor, table_name, header, sample_row):
-    """Create a SQL table using the header and inferred types."""
+def infer_column_types(header, sample_rows):
+    """Infer one SQLite type per column from a sample of rows (empty values are ignored)."""
     column_types = []
-    for col_name, sample_value in zip(header, sample_row):
-        col_type = infer_type(sample_value)
-        column_types.append((col_name, col_type))
+    for i in range(len(header)):
+        types = {infer_type(row[i]) for row in sample_rows if i < len(row) and row[i] != ""}
+        if not types or "TEXT" in types:
+            column_types.append("TEXT")
+        elif "REAL" in types:
+            column_types.append("REAL")
+        else:
+            column_types.append("INTEGER")
+    return column_types
+
+
+def create_table_from_csv(cursor, table_name, header, sample_rows):
+    """Create a SQL table using the header and types inferred from sample rows."""
+    column_types = zip(header, infer_column_types(header, sample_rows))
 
     columns_sql = ", ".join([f'"{name}" {ctype}' for name, ctype in column_types])
     cursor.execute(f'DROP TABLE IF EXISTS "{table_name}"')
     cursor.execute(f'CREATE TABLE "{table_name}" ({columns_sql});')
 
 
-def insert_csv_into_table(cursor, table_name, header, rows):
-    """Insert all rows into the table efficiently."""
+def insert_csv_into_table(cursor, table_name, header, rows, chunk_size=CHUNK_SIZE):
+    """Insert rows (any iterable) into the table in fixed-size executemany chunks."""
     placeholders = ", ".join(["?"] * len(header))
-    cursor.executemany(
-        f'INSERT INTO "{table_name}" VALUES ({placeholders})', rows
-    )
+    sql = f'INSERT INTO "{table_name}" VALUES ({placeholders})'
+    rows = iter(rows)
+    n_rows = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        cursor.executemany(sql, chunk)
+        n_rows += len(chunk)
+    return n_rows
+
+
+def create_indexes(cursor, table_name, header, index_columns=INDEX_COLUMNS):
+    """Index the timestamp columns of the table, if it has them."""
+    for col in index_columns:
+        if col not in header:
+            continue
+        index_name = "idx_" + "".join(c if c.isalnum() else "_" for c in f"{table_name}_{col}")
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}" ("{col}")')
+
+
+def csv_to_sqlite(csv_folder, sqlite_path, verbose=True, chunk_size=CHUNK_SIZE, sample_size=TYPE_SAMPLE_SIZE):
+    """
+    Load all CSV files in a folder into a SQLite database.
+    CSVs are streamed in chunks inside a single transaction, never fully loaded in memory.
+    The import goes to sqlite_path + ".tmp", which replaces sqlite_path only once complete:
+    an interrupted import never leaves a partial database behind.
+    """
+    tmp_path = sqlite_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)  # leftover from an interrupted import
+
+    conn = sqlite3.connect(tmp_path, isolation_level=None)
+    try:
+        _import_csv_folder(conn.cursor(), csv_folder, verbose, chunk_size, sample_size)
+        conn.close()
+        os.replace(tmp_path, sqlite_path)
+    except BaseException:
+        conn.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    print(f"\nDone! SQLite DB created at: {sqlite_path}")
 
 
-def csv_to_sqlite(csv_folder, sqlite_path, verbose=True):
-    """Load all CSV files in a folder into a SQLite database."""
-    conn = sqlite3.connect(sqlite_path)
-    cursor = conn.cursor()
+def _import_csv_folder(cursor, csv_folder, verbose, chunk_size, sample_size):
+    """Import every CSV of csv_folder in one transaction (rolled back on error)."""
+    for pragma, value in BULK_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma} = {value}")
 
-    for filename in os.listdir(csv_folder):
+    cursor.execute("BEGIN")
+    try:
+        _import_tables(cursor, csv_folder, verbose, chunk_size, sample_size)
+    except BaseException:
+        cursor.execute("ROLLBACK")
+        raise
+    cursor.execute("COMMIT")
+
+
+def _import_tables(cursor, csv_folder, verbose, chunk_size, sample_size):
+    for filename in sorted(os.listdir(csv_folder)):
         if not filename.lower().endswith(".csv"):
             continue
 
@@ -61,20 +137,20 @@ def csv_to_sqlite(csv_folder, sqlite_path, verbose=True):
         with open(csv_path, newline="", encoding="utf-8") as f:
             reader = csv.reader(f)
             header = next(reader)
-            rows = list(reader)
+            sample = list(islice(reader, sample_size))
 
-        if len(rows) == 0:
-            print(f"Skipping empty CSV: {filename}")
-            continue
+            if len(sample) == 0:
+                print(f"Skipping empty CSV: {filename}")
+                continue
 
-        # Use first row to infer types
-        create_table_from_csv(cursor, table_name, header, rows[0])
+            # Use a sample of rows to infer types
+            create_table_from_csv(cursor, table_name, header, sample)
 
-        insert_csv_into_table(cursor, table_name, header, rows)
+            n_rows = insert_csv_into_table(cursor, table_name, header, chain(sample, reader), chunk_size)
 
-    conn.commit()
-    conn.close()
-    print(f"\nDone! SQLite DB created at: {sqlite_path}")
+        create_indexes(cursor, table_name, header)
+        if verbose:
+            print(f"  {n_rows} rows")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,247 @@
+import os
+import csv
+import json
+import time
+import sqlite3
+import pandas as pd
+from pathlib import Path
+from contextlib import contextmanager
+from dataclasses import asdict
+from typing import List, Dict, Any, Optional
+from structures import PosterDetection, PosterDetections
+from profiling import PROFILER
+
+# Colonnes écrites, dans l'ordre de PosterDetection
+DETECTION_COLUMNS = list(PosterDetection.__dataclass_fields__)
+FORMATS = ("csv", "sqlite", "parquet")
+EXTENSIONS = {"csv": ".csv", "sqlite": ".sqlite", "parquet": ".parquet"}
+
+# Écriture par lots : on vide le tampon toutes les FLUSH_ROWS détections
+# ou toutes les FLUSH_SECONDS secondes
+FLUSH_ROWS = 500
+FLUSH_SECONDS = 30.0
+
+
+def _write_json_atomic(path: Path, data: Dict[str, Any]):
+    """Écrit un fichier JSON d'un coup (fichier temporaire puis os.replace)"""
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+@contextmanager
+def _sqlite_connection(path: Path):
+    """Connexion SQLite : transaction validée en sortie de bloc (annulée sur exception), puis fermée"""
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+class DetectionWriter:
+    """
+    Écriture en flux, en ajout seulement, des PosterDetection d'un sujet (CSV, SQLite ou Parquet),
+    avec un point de reprise : {output_dir}/{sujet}.checkpoint.json contient le dernier
+    fixation_id traité (les fixations sont traitées dans l'ordre du temps).
+    Le checkpoint n'est mis à jour qu'après l'écriture des lignes ; à la reprise, tout ce qui
+    a été écrit après le dernier checkpoint est retiré, il n'y a donc ni perte ni doublon.
+    Parquet : un fichier par lot dans {output_dir}/{sujet}.parquet/ (nécessite pyarrow).
+    params : paramètres qui déterminent les détections (backend, seuils...), enregistrés dans le
+    checkpoint ; une exécution avec d'autres paramètres recommence au lieu de reprendre.
+    """
+
+    def __init__(self, output_dir: str, sujet: str, fmt: str = "csv", resume: bool = True,
+                 flush_rows: int = FLUSH_ROWS, flush_seconds: float = FLUSH_SECONDS,
+                 params: Optional[Dict[str, Any]] = None):
+        if fmt not in FORMATS:
+            raise ValueError(f"Format inconnu : {fmt} (disponibles : {', '.join(FORMATS)})")
+        if fmt == "parquet":
+            import pyarrow  # noqa: F401  (dépendance optionnelle, erreur explicite dès l'ouverture)
+
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.sujet = sujet
+        self.fmt = fmt
+        self.path = self.output_dir / f"{sujet}{EXTENSIONS[fmt]}"
+        self.checkpoint_path = self.output_dir / f"{sujet}.checkpoint.json"
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        # Aller-retour JSON pour comparer avec le checkpoint relu (tuples -> listes...)
+        self.params = json.loads(json.dumps(params or {}))
+
+        self.buffer: List[PosterDetection] = []
+        self.pending_fixation_id: Optional[int] = None
+        self.last_flush = time.monotonic()
+
+        self.checkpoint = self._load_checkpoint() if resume else None
+        if self.checkpoint is None:
+            self._reset()
+        else:
+            self._rollback()
+
+    # --- checkpoint -------------------------------------------------------
+
+    def _load_checkpoint(self) -> Optional[Dict[str, Any]]:
+        if not self.checkpoint_path.exists():
+            return None
+        with open(self.checkpoint_path, "r") as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("format") != self.fmt:
+            print(f"[WARN] Checkpoint de {self.sujet} au format {checkpoint.get('format')}, on recommence")
+            return None
+        if checkpoint.get("columns") != DETECTION_COLUMNS:
+            print(f"[WARN] Checkpoint de {self.sujet} écrit avec d'autres colonnes, on recommence")
+            return None
+        if checkpoint.get("params", {}) != self.params:
+            print(f"[INFO] Checkpoint de {self.sujet} obtenu avec d'autres paramètres "
+                  f"({checkpoint.get('params', {})}), on recommence")
+            return None
+        if not self._output_matches(checkpoint):
+            print(f"[WARN] Sorties de {self.sujet} absentes ou incomplètes par rapport au checkpoint, on recommence")
+            return None
+        return checkpoint
+
+    def _output_matches(self, checkpoint: Dict[str, Any]) -> bool:
+        """Les fichiers décrits par le checkpoint sont toujours là"""
+        if self.fmt == "csv":
+            return self.path.is_file() and self.path.stat().st_size >= checkpoint["csv_size"]
+        if self.fmt == "sqlite":
+            return self.path.is_file()
+        return self.path.is_dir() and all((self.path / part).exists() for part in checkpoint["parts"])
+
+    def _save_checkpoint(self):
+        _write_json_atomic(self.checkpoint_path, self.checkpoint)
+
+    @property
+    def last_fixation_id(self) -> int:
+        """Dernière fixation traitée lors des exécutions précédentes (-1 si aucune)"""
+        return self.checkpoint["last_fixation_id"]
+
+    @property
+    def done(self) -> bool:
+        """Le sujet a été entièrement traité"""
+        return self.checkpoint["done"]
+
+    def _reset(self):
+        """Nouveau départ : supprime les sorties précédentes du sujet"""
+        if self.path.is_dir():
+            for part in self.path.glob("*.parquet"):
+                part.unlink()
+        elif self.path.exists():
+            self.path.unlink()
+        self.checkpoint = {"sujet": self.sujet, "format": self.fmt, "last_fixation_id": -1,
+                           "rows": 0, "done": False, "csv_size": 0, "parts": [],
+                           "columns": DETECTION_COLUMNS, "params": self.params}
+        if self.fmt == "csv":
+            with open(self.path, "w", newline="") as f:
+                csv.writer(f).writerow(DETECTION_COLUMNS)
+            self.checkpoint["csv_size"] = self.path.stat().st_size
+        elif self.fmt == "sqlite":
+            with _sqlite_connection(self.path) as conn:
+                conn.execute(f'CREATE TABLE IF NOT EXISTS detections ({", ".join(DETECTION_COLUMNS)})')
+        else:
+            self.path.mkdir(parents=True, exist_ok=True)
+        self._save_checkpoint()
+
+    def _rollback(self):
+        """Retire ce qui a été écrit après le dernier checkpoint (arrêt entre écriture et checkpoint)"""
+        if self.fmt == "csv":
+            with open(self.path, "r+b") as f:
+                f.truncate(self.checkpoint["csv_size"])
+        elif self.fmt == "sqlite":
+            with _sqlite_connection(self.path) as conn:
+                conn.execute("DELETE FROM detections WHERE fixation_id > ?", (self.last_fixation_id,))
+        else:
+            kept = set(self.checkpoint["parts"])
+            for part in self.path.glob("*.parquet"):
+                if part.name not in kept:
+                    part.unlink()
+
+    # --- écriture ---------------------------------------------------------
+
+    def write(self, detection: PosterDetection):
+        self.buffer.append(detection)
+
+    def mark_processed(self, fixation_id: int):
+        """
+        Fixation traitée (détectée ou non). Vide le tampon si FLUSH_ROWS
+        ou FLUSH_SECONDS sont atteints.
+        """
+        self.pending_fixation_id = int(fixation_id)
+        if len(self.buffer) >= self.flush_rows or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        if self.pending_fixation_id is None and not self.buffer:
+            return
+        with PROFILER.stage("write"):
+            if self.buffer:
+                self._append(pd.DataFrame([asdict(d) for d in self.buffer], columns=DETECTION_COLUMNS))
+                self.checkpoint["rows"] += len(self.buffer)
+            if self.pending_fixation_id is not None:
+                self.checkpoint["last_fixation_id"] = max(self.last_fixation_id, self.pending_fixation_id)
+            self._save_checkpoint()
+        self.buffer = []
+        self.pending_fixation_id = None
+        self.last_flush = time.monotonic()
+
+    def _append(self, df: pd.DataFrame):
+        if self.fmt == "csv":
+            with open(self.path, "a", newline="") as f:
+                df.to_csv(f, header=False, index=False)
+                f.flush()
+                os.fsync(f.fileno())
+            self.checkpoint["csv_size"] = self.path.stat().st_size
+        elif self.fmt == "sqlite":
+            with _sqlite_connection(self.path) as conn:
+                conn.executemany(
+                    f'INSERT INTO detections VALUES ({", ".join("?" * len(DETECTION_COLUMNS))})',
+                    df.itertuples(index=False, name=None),
+                )
+        else:
+            part = f"part-{int(df['fixation_id'].iloc[0]):08d}.parquet"
+            df.to_parquet(self.path / part, index=False)
+            self.checkpoint["parts"].append(part)
+
+    def finish(self):
+        """Vide le tampon et marque le sujet comme terminé"""
+        self.flush()
+        self.checkpoint["done"] = True
+        self._save_checkpoint()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def read(self) -> PosterDetections:
+        """Toutes les détections écrites pour ce sujet (exécutions précédentes comprises)"""
+        self.flush()
+        return read_detections(self.output_dir, self.sujet, self.fmt)
+
+
+def read_detections(output_dir: str, sujet: str, fmt: str = "csv") -> PosterDetections:
+    """Relit les détections d'un sujet écrites par DetectionWriter"""
+    path = Path(output_dir) / f"{sujet}{EXTENSIONS[fmt]}"
+    if not path.exists():
+        return PosterDetections()
+    if fmt == "csv":
+        df = pd.read_csv(path, dtype={"poster_name": str, "backend": str})
+    elif fmt == "sqlite":
+        with _sqlite_connection(path) as conn:
+            df = pd.read_sql_query("SELECT * FROM detections ORDER BY fixation_id", conn)
+    else:
+        parts = sorted(path.glob("*.parquet"))
+        df = pd.concat([pd.read_parquet(p) for p in parts], ignore_index=True) if parts else None
+    if df is None or df.empty:
+        return PosterDetections()
+    return PosterDetections.from_columns(**{col: df[col].to_numpy() for col in DETECTION_COLUMNS})
@@ -0,0 +1,179 @@
+import sqlite3
+import numpy as np
+from typing import Dict, Optional, Tuple
+from appelsDB import (load_columns, load_fixations_arrays, DB_PATH, WORLD_TS, WORLD_TS_COL,
+                      GAZE_TS_COL)
+
+# Index d'alignement frame <-> regard, calculé une fois à partir des timestamps réels
+# des frames (world_timestamps) et stocké dans la DB du sujet
+FRAME_INDEX_TABLE = "frame_index"
+FIXATION_FRAMES_TABLE = "fixation_frames"
+ALIGNMENT_META_TABLE = "alignment_meta"
+ALIGNMENT_VERSION = 1  # à incrémenter si le contenu des tables change
+
+# Colonnes (suffixe [idx] : indices entiers, voir appelsDB.column_dtype)
+FRAME_COL = "frame [idx]"
+GAZE_START_COL = "gaze start [idx]"      # premier échantillon de regard de la frame
+GAZE_END_COL = "gaze end [idx]"          # fin (exclue) des échantillons de la frame
+GAZE_NEAREST_COL = "gaze nearest [idx]"  # échantillon le plus proche du timestamp de la frame
+FIX_ID_COL = "fixation id [idx]"
+FIX_START_FRAME_COL = "start frame [idx]"
+FIX_MID_FRAME_COL = "mid frame [idx]"
+FIX_END_FRAME_COL = "end frame [idx]"
+
+# Écart max entre une frame et son échantillon de regard le plus proche
+GAZE_TOLERANCE_NS = 10_000_000
+
+
+def frame_at(world_ts: np.ndarray, ts: np.ndarray) -> np.ndarray:
+    """Indice de la frame affichée à chaque instant ts (dernière frame de timestamp <= ts, -1 avant la première)"""
+    return (np.searchsorted(world_ts, ts, side="right") - 1).astype(np.int64)
+
+
+def find_gaze_for_frames(frame_times_ns: np.ndarray, gaze_ts: np.ndarray,
+                         tolerance_ns: Optional[int] = GAZE_TOLERANCE_NS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Échantillon de regard le plus proche de chaque frame (à égalité, le plus ancien), vectorisé.
+    gaze_ts : timestamps (ns) triés. Renvoie (indices, valid) : indice de l'échantillon le plus
+    proche et masque des frames qui en ont un à moins de tolerance_ns (None = pas de limite).
+    Sans regard : indices à -1 et aucune frame valide.
+    """
+    frame_times_ns = np.asarray(frame_times_ns, dtype=np.int64)
+    gaze_ts = np.asarray(gaze_ts, dtype=np.int64)
+    n = len(gaze_ts)
+    if n == 0:
+        return np.full(len(frame_times_ns), -1, dtype=np.int64), np.zeros(len(frame_times_ns), dtype=bool)
+
+    idx = np.searchsorted(gaze_ts, frame_times_ns)
+    left = np.clip(idx - 1, 0, n - 1)
+    right = np.clip(idx, 0, n - 1)
+    dist_left = np.abs(gaze_ts[left] - frame_times_ns)
+    dist_right = np.abs(gaze_ts[right] - frame_times_ns)
+
+    best = np.where(dist_right < dist_left, right, left).astype(np.int64)
+    if tolerance_ns is None:
+        return best, np.ones(len(frame_times_ns), dtype=bool)
+    return best, np.minimum(dist_left, dist_right) <= tolerance_ns
+
+
+def compute_alignment(world_ts: np.ndarray, gaze_ts: np.ndarray, fixations: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    Index d'alignement, entièrement vectorisé.
+    world_ts, gaze_ts : timestamps (ns) triés des frames et des échantillons de regard.
+    Les échantillons de la frame i sont ceux de timestamp dans ]world_ts[i-1], world_ts[i]]
+    (tout ce qui précède la première frame est rattaché à la frame 0), soit gaze_ts[start:end].
+    Les indices de regard se réfèrent au regard trié par timestamp.
+    """
+    world_ts = np.asarray(world_ts, dtype=np.int64)
+    gaze_ts = np.asarray(gaze_ts, dtype=np.int64)
+    n_frames = len(world_ts)
+
+    gaze_end = np.searchsorted(gaze_ts, world_ts, side="right").astype(np.int64)
+    gaze_start = np.concatenate(([0], gaze_end[:-1])).astype(np.int64)[:n_frames]
+
+    # Échantillon le plus proche (à égalité, le plus ancien), sans limite d'écart
+    nearest, _ = find_gaze_for_frames(world_ts, gaze_ts, tolerance_ns=None)
+
+    mid_ts = (fixations["start"] + fixations["end"]) // 2
+    return {
+        "frame_ts": world_ts,
+        "gaze_start": gaze_start,
+        "gaze_end": gaze_end,
+        "gaze_nearest": nearest,
+        "fix_start_frame": frame_at(world_ts, fixations["start"]),
+        "fix_mid_frame": frame_at(world_ts, mid_ts),
+        "fix_end_frame": frame_at(world_ts, fixations["end"]),
+    }
+
+
+def build_alignment(db_path: str = DB_PATH, gaze_table: str = "gaze", fix_table: str = "fixations",
+                    world_table: str = WORLD_TS) -> Dict[str, np.ndarray]:
+    """Calcule l'index d'alignement et l'écrit dans la DB (tables frame_index et fixation_frames)"""
+    world_ts = load_columns(db_path, [WORLD_TS_COL], world_table, order_by=WORLD_TS_COL)[WORLD_TS_COL]
+    gaze_ts = load_columns(db_path, [GAZE_TS_COL], gaze_table, order_by=GAZE_TS_COL)[GAZE_TS_COL]
+    fixations = load_fixations_arrays(db_path, fix_table)
+    alignment = compute_alignment(world_ts, gaze_ts, fixations)
+
+    frame_rows = zip(range(len(world_ts)), alignment["frame_ts"].tolist(), alignment["gaze_start"].tolist(),
+                     alignment["gaze_end"].tolist(), alignment["gaze_nearest"].tolist())
+    fix_rows = zip(range(len(fixations["start"])), alignment["fix_start_frame"].tolist(),
+                   alignment["fix_mid_frame"].tolist(), alignment["fix_end_frame"].tolist())
+    meta = {
+        "version": ALIGNMENT_VERSION,
+        "n_frames": len(world_ts),
+        "n_gaze": len(gaze_ts),
+        "n_fixations": len(fixations["start"]),
+    }
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        cursor.execute(f'DROP TABLE IF EXISTS "{FRAME_INDEX_TABLE}"')
+        cursor.execute(f'DROP TABLE IF EXISTS "{FIXATION_FRAMES_TABLE}"')
+        cursor.execute(f'DROP TABLE IF EXISTS "{ALIGNMENT_META_TABLE}"')
+        cursor.execute(
+            f'CREATE TABLE "{FRAME_INDEX_TABLE}" ("{FRAME_COL}" INTEGER PRIMARY KEY, "{WORLD_TS_COL}" INTEGER, '
+            f'"{GAZE_START_COL}" INTEGER, "{GAZE_END_COL}" INTEGER, "{GAZE_NEAREST_COL}" INTEGER)'
+        )
+        cursor.execute(
+            f'CREATE TABLE "{FIXATION_FRAMES_TABLE}" ("{FIX_ID_COL}" INTEGER PRIMARY KEY, '
+            f'"{FIX_START_FRAME_COL}" INTEGER, "{FIX_MID_FRAME_COL}" INTEGER, "{FIX_END_FRAME_COL}" INTEGER)'
+        )
+        cursor.execute(f'CREATE TABLE "{ALIGNMENT_META_TABLE}" (key TEXT PRIMARY KEY, value INTEGER)')
+        cursor.executemany(f'INSERT INTO "{FRAME_INDEX_TABLE}" VALUES (?, ?, ?, ?, ?)', frame_rows)
+        cursor.executemany(f'INSERT INTO "{FIXATION_FRAMES_TABLE}" VALUES (?, ?, ?, ?)', fix_rows)
+        cursor.executemany(f'INSERT INTO "{ALIGNMENT_META_TABLE}" VALUES (?, ?)', meta.items())
+        cursor.execute("COMMIT")
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return alignment
+
+
+def _alignment_up_to_date(db_path: str, gaze_table: str, fix_table: str, world_table: str) -> bool:
+    """L'index existe, est à la bonne version et correspond au nombre de lignes des tables sources"""
+    conn = sqlite3.connect(db_path)
+    try:
+        cursor = conn.cursor()
+        try:
+            meta = dict(cursor.execute(f'SELECT key, value FROM "{ALIGNMENT_META_TABLE}"').fetchall())
+        except sqlite3.OperationalError:
+            return False
+        counts = {
+            "n_frames": cursor.execute(f'SELECT COUNT(*) FROM "{world_table}"').fetchone()[0],
+            "n_gaze": cursor.execute(f'SELECT COUNT(*) FROM "{gaze_table}"').fetchone()[0],
+            "n_fixations": cursor.execute(f'SELECT COUNT(*) FROM "{fix_table}"').fetchone()[0],
+        }
+    finally:
+        conn.close()
+    return meta.get("version") == ALIGNMENT_VERSION and all(meta.get(k) == v for k, v in counts.items())
+
+
+def load_alignment(db_path: str = DB_PATH, gaze_table: str = "gaze", fix_table: str = "fixations",
+                   world_table: str = WORLD_TS) -> Dict[str, np.ndarray]:
+    """
+    Index d'alignement de la DB du sujet (construit et stocké au premier appel).
+    Tableaux indexés par frame : frame_ts, gaze_start, gaze_end, gaze_nearest ;
+    indexés par fixation (ordre de load_fixations_arrays) : fix_start_frame, fix_mid_frame, fix_end_frame.
+    """
+    if not _alignment_up_to_date(db_path, gaze_table, fix_table, world_table):
+        print(f"[INFO] Construction de l'index frame <-> regard dans {db_path}")
+        return build_alignment(db_path, gaze_table, fix_table, world_table)
+
+    frames = load_columns(db_path, [WORLD_TS_COL, GAZE_START_COL, GAZE_END_COL, GAZE_NEAREST_COL],
+                          FRAME_INDEX_TABLE, order_by=FRAME_COL)
+    fixations = load_columns(db_path, [FIX_START_FRAME_COL, FIX_MID_FRAME_COL, FIX_END_FRAME_COL],
+                             FIXATION_FRAMES_TABLE, order_by=FIX_ID_COL)
+    return {
+        "frame_ts": frames[WORLD_TS_COL],
+        "gaze_start": frames[GAZE_START_COL],
+        "gaze_end": frames[GAZE_END_COL],
+        "gaze_nearest": frames[GAZE_NEAREST_COL],
+        "fix_start_frame": fixations[FIX_START_FRAME_COL],
+        "fix_mid_frame": fixations[FIX_MID_FRAME_COL],
+        "fix_end_frame": fixations[FIX_END_FRAME_COL],
+    }
@@ -1,11 +1,17 @@
+import cv2
 import plotly.graph_objects as go
 import numpy as np
+from pathlib import Path
 from PIL import Image
 from heat_map_utils import *
 
 
 
-def step_heat_map(x, y, nom, trace=False):
+def step_heat_map(x, y, nom, trace=False, output_path=None):
+    """
+    output_path : écrit l'affiche avec sa heatmap dans ce fichier (PNG/JPEG)
+    au lieu de l'afficher dans le navigateur (pas besoin d'écran).
+    """
 
     # Charger l'image
     affiche_path = f'./data/Affiches/{nom}.png'
@@ -18,6 +24,10 @@ def step_heat_map(x, y, nom, trace=False):
     # Calculer la densité
     z = heat_map_density(x, y, W, H, 300)
 
+    if output_path is not None:
+        export_heat_map(affiche_path, z, output_path)
+        return
+
     if trace:
         show_points_on_poster(affiche_path, x, y)
 
@@ -27,78 +37,113 @@ def step_heat_map(x, y, nom, trace=False):
 
 
 
-def heat_map_density(x, y, W, H, distance=200):
-    # Initialiser la matrice de densité
-    z = np.zeros((H, W))
-
-    # Créer le masque de distance
+def cone_mask(distance=200):
+    # Masque en cône : 1 au centre, décroît linéairement jusqu'à 0 à distance // 2
     center = distance // 2
-    mask = np.zeros((distance, distance))
-    
-    # Remplir le masque avec des valeurs décroissantes
     y_indices, x_indices = np.ogrid[:distance, :distance]
     dist_from_center = np.sqrt((y_indices - center) ** 2 + (x_indices - center) ** 2)
-    mask = np.maximum(0, (center - dist_from_center) / center)
-
-    # Ajouter la contribution de chaque point de regard
-    for i in range(len(x)):
-        try:
-            if np.isnan(x[i]) or np.isnan(y[i]):
-                continue
-
-            x_pos = int(x[i])
-            y_pos = int(y[i])
-
-            # Définir les limites pour appliquer le masque
-            x_start = max(0, x_pos - center)
-            x_end = min(W, x_pos + center)
-            y_start = max(0, y_pos - center)
-            y_end = min(H, y_pos + center)
-
-            # Vérifier si les limites sont valides
-            if x_end <= x_start or y_end <= y_start:
-                continue
-
-            # Calculer les dimensions
-            region_width = x_end - x_start
-            region_height = y_end - y_start
-
-            # Définir les limites du masque
-            mask_x_start = max(0, center - x_pos)
-            mask_y_start = max(0, center - y_pos)
-            
-            mask_x_end = mask_x_start + region_width
-            mask_y_end = mask_y_start + region_height
+    return np.maximum(0, (center - dist_from_center) / center)
 
-            # Extraire la portion du masque
-            mask_portion = mask[mask_y_start:mask_y_end, mask_x_start:mask_x_end]
-            
-            # Ajouter au résultat
-            z[y_start:y_end, x_start:x_end] += mask_portion
-            
-        except Exception as e:
-            # Log l'erreur et continuer avec le point suivant
-            print(f"Erreur avec le point {i} (x={x[i]}, y={y[i]}): {e}")
-            continue
 
-    return z
 
+# Au-delà de ce nombre de points, une seule convolution de la grille de comptage
+# (cv2.filter2D) coûte moins cher que d'ajouter le masque point par point
+DIRECT_MAX_POINTS = 2000
 
 
-def show_points_on_poster(affiche_path, x, y, plot_W=400):
-
-    # Changer le chemin de l'image selon le nom de l'affiche
+def heat_map_density(x, y, W, H, distance=200):
+    # Chaque point ajoute mask[:2c, :2c] centré sur (int(x), int(y)), coupé aux bords.
+    # Peu de points : on ajoute le masque à chaque point dans une grille avec une marge.
+    # Beaucoup de points : on compte les points par pixel (bincount) puis on convolue
+    # une seule fois la grille de comptage avec le masque (cv2.filter2D).
+    center = distance // 2
+    kernel = cone_mask(distance)[:2 * center, :2 * center]
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    x_pos = np.trunc(x[valid]).astype(np.int64)
+    y_pos = np.trunc(y[valid]).astype(np.int64)
+
+    # Les points hors image contribuent encore s'ils sont à moins de `center` du bord
+    keep = (x_pos > -center) & (x_pos < W + center) & (y_pos > -center) & (y_pos < H + center)
+    x_pos = x_pos[keep] + center
+    y_pos = y_pos[keep] + center
+
+    if len(x_pos) == 0 or center == 0:
+        return np.zeros((H, W))
+
+    # Grilles avec une marge de `center` autour de l'image
+    Hp, Wp = H + 2 * center, W + 2 * center
+    if len(x_pos) <= DIRECT_MAX_POINTS:
+        z = np.zeros((Hp + 2 * center, Wp + 2 * center))
+        for xp, yp in zip(x_pos.tolist(), y_pos.tolist()):
+            z[yp:yp + 2 * center, xp:xp + 2 * center] += kernel
+        return np.ascontiguousarray(z[2 * center:2 * center + H, 2 * center:2 * center + W])
+
+    counts = np.bincount(y_pos * Wp + x_pos, minlength=Hp * Wp).reshape(Hp, Wp).astype(np.float64)
+    # filter2D calcule une corrélation : masque retourné, ancre en (c-1, c-1) pour que
+    # chaque point ajoute kernel[j, i] en (y - c + j, x - c + i)
+    full = cv2.filter2D(counts, cv2.CV_64F, np.ascontiguousarray(kernel[::-1, ::-1]),
+                        anchor=(center - 1, center - 1), borderType=cv2.BORDER_CONSTANT)
+    z = full[center:center + H, center:center + W]
+
+    # Bruit d'arrondi de la convolution (faite par DFT pour un grand masque) :
+    # les valeurs non nulles du masque sont bien au-dessus de 1e-9
+    z[z < 1e-9] = 0.0
+    return np.ascontiguousarray(z)
+
+
+
+# Palette de la heatmap (transparente pour une densité nulle)
+HEATMAP_COLORSCALE = [
+    [0.0, "rgba(255,255,255,0.0)"],
+    [0.2, "rgba(0,0,255,0.4)"],
+    [0.4, "rgba(0,255,0,0.9)"],
+    [0.6, "rgba(255,255,0,0.9)"],
+    [0.8, "rgba(255,165,0,0.9)"],
+    [1.0, "rgba(255,0,0,0.9)"]
+]
+
+# Qualité des exports JPEG (export_heat_map)
+JPEG_QUALITY = 90
+
+# Résolution d'affichage : grille et image de fond réduites à DISPLAY_OVERSAMPLE x plot_W
+# (au-delà, le navigateur ne peut pas afficher plus de détails)
+DISPLAY_OVERSAMPLE = 2
+# Nombre max de pas du slider de l'animation du parcours
+MAX_ANIMATION_STEPS = 100
+
+
+
+def downsample_grid(z, max_side):
+    """
+    Réduit une grille de densité (moyenne par zone, cv2.INTER_AREA) pour que son plus grand
+    côté ne dépasse pas max_side. Renvoie (z réduite, (largeur, hauteur) d'une cellule en px de l'affiche).
+    """
+    z = np.asarray(z, dtype=np.float32)
+    H, W = z.shape
+    scale = min(1.0, max_side / max(H, W))
+    if scale >= 1.0:
+        return z, (1.0, 1.0)
+    w, h = max(1, round(W * scale)), max(1, round(H * scale))
+    return cv2.resize(z, (w, h), interpolation=cv2.INTER_AREA), (W / w, H / h)
+
+
+
+def _poster_figure(affiche_path, plot_W):
+    """Figure avec l'affiche en fond (réduite à la résolution d'affichage), axes en px de l'affiche"""
     poster = Image.open(affiche_path)
     W, H = poster.size  # dimensions réelles de l'image
-    n_points = len(x)
+    background = poster.copy()
+    background.thumbnail((DISPLAY_OVERSAMPLE * plot_W, DISPLAY_OVERSAMPLE * plot_W * H // W + 1))
 
-    # Création du graphe
     fig = go.Figure()
 
-    # Ajouter l'image en dessous
+    # Ajouter l'image en dessous (étirée sur les dimensions réelles)
     fig.add_layout_image(
         dict(
-            source=poster,
+            source=background,
             x=0,
             y=H,
             sizex=W,
@@ -111,26 +156,62 @@ def show_points_on_poster(affiche_path, x, y, plot_W=400):
         )
     )
 
-    # Créer des frames pour l'animation
-    frames = []
-    for i in range(1, n_points + 1):
-        frame = go.Frame(
-            data=[
-                go.Scatter(x=x[:i], y=y[:i], mode='markers', marker=dict(color='red', size=6)),
-                go.Scatter(x=x[:i], y=y[:i], mode='lines', line=dict(color='red', width=2), hoverinfo='skip')
-            ],
-            name=str(i)
-        )
-        frames.append(frame)
+    # Ajuster les axes pour correspondre à l'image
+    fig.update_xaxes(range=[0, W], showgrid=False, zeroline=False, visible=False)
+    fig.update_yaxes(range=[0, H], showgrid=False, zeroline=False, visible=False, scaleanchor="x")
+
+    # Rendu propre : enlever marges
+    fig.update_layout(
+        template="plotly_dark",
+        margin=dict(l=0, r=0, t=0, b=0),
+        width=plot_W,
+        height=int(plot_W * (H / W)),
+        showlegend=False)
+    return fig, W, H
+
 
-    # Ajouter le premier point/ligne
-    fig.add_trace(go.Scatter(x=[x[0]], y=[y[0]], mode='markers', marker=dict(color='red', size=6)))
-    fig.add_trace(go.Scatter(x=[x[0]], y=[y[0]], mode='lines', line=dict(color='red', width=2), hoverinfo='skip'))
 
-    # Ajouter les frames à la figure
+def show_points_on_poster(affiche_path, x, y, plot_W=400, t=None, max_steps=MAX_ANIMATION_STEPS):
+    """
+    Parcours du regard sur l'affiche, animé avec un slider temporel.
+    Les points sont découpés en au plus max_steps segments, un trace WebGL (Scattergl) par
+    segment : chaque pas du slider ne fait qu'afficher un segment de plus, les données
+    ne sont envoyées qu'une fois (pas de frames cumulatives x[:i]).
+    t (optionnel) : temps de chaque point (s), pour les étiquettes du slider.
+    """
+    fig, W, H = _poster_figure(affiche_path, plot_W)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n_points = len(x)
+    if n_points == 0:
+        fig.show()
+        return
+
+    # Bornes des segments ; chaque segment reprend le dernier point du précédent (tracé continu)
+    n_steps = min(max_steps, n_points)
+    bounds = np.linspace(0, n_points, n_steps + 1).astype(int)
+    for k in range(n_steps):
+        lo, hi = max(bounds[k] - 1, 0), bounds[k + 1]
+        fig.add_trace(go.Scattergl(
+            x=x[lo:hi], y=y[lo:hi], mode='lines+markers',
+            marker=dict(color='red', size=6), line=dict(color='red', width=2),
+            hoverinfo='skip', visible=(k == 0),
+        ))
+
+    # Frames légères : seulement la visibilité des segments
+    frames = []
+    steps = []
+    for k in range(n_steps):
+        name = str(k)
+        frames.append(go.Frame(data=[dict(visible=j <= k) for j in range(n_steps)],
+                               traces=list(range(n_steps)), name=name))
+        last = bounds[k + 1] - 1
+        label = f"{t[last]:.1f} s" if t is not None else str(last + 1)
+        steps.append(dict(method="animate", label=label,
+                          args=[[name], dict(mode="immediate", frame=dict(duration=0, redraw=True))]))
     fig.frames = frames
 
-    # Boutons d'animation en haut à gauche
+    # Bouton Play en haut à gauche et slider en bas
     fig.update_layout(
         updatemenus=[dict(
             type="buttons",
@@ -142,77 +223,100 @@ def show_points_on_poster(affiche_path, x, y, plot_W=400):
             pad=dict(t=0, l=10),
             buttons=[dict(label="Play",
                         method="animate",
-                        args=[None, dict(frame=dict(duration=5, redraw=True), fromcurrent=True, mode='immediate')])]
-        )]
+                        args=[None, dict(frame=dict(duration=50, redraw=True), fromcurrent=True, mode='immediate')])]
+        )],
+        sliders=[dict(active=0, steps=steps, pad=dict(t=0, b=0), currentvalue=dict(visible=False))],
     )
 
-    # Ajuster les axes pour correspondre à l'image
-    fig.update_xaxes(range=[0, W], showgrid=False, zeroline=False, visible=False)
-    fig.update_yaxes(range=[0, H], showgrid=False, zeroline=False, visible=False, scaleanchor="x")
-
-    # Rendu propre : enlever marges
-    fig.update_layout(
-        template="plotly_dark",
-        margin=dict(l=0, r=0, t=0, b=0),
-        width=plot_W,
-        height=int(plot_W * (H / W)),
-        showlegend=False)
-    
     fig.show()
 
 
 
 def show_heat_map_on_poster(affiche_path, z, plot_W=400):
+    """
+    Heatmap sur l'affiche. z (H x W, pleine résolution de l'affiche, éventuellement
+    memory-mappée) est réduite à la résolution d'affichage avant d'être envoyée au navigateur.
+    """
+    fig, W, H = _poster_figure(affiche_path, plot_W)
 
-    # Changer le chemin de l'image selon le nom de l'affiche
-    poster = Image.open(affiche_path)
-    W, H = poster.size  # dimensions réelles de l'image
-
-    # Création du graphe
-    fig = go.Figure()
-
-    # Ajouter l'image en dessous
-    fig.add_layout_image(
-        dict(
-            source=poster,
-            x=0,
-            y=H,
-            sizex=W,
-            sizey=H,
-            xref="x",
-            yref="y",
-            sizing="stretch",
-            opacity=1,
-            layer="below"
-        )
-    )
-
+    z_display, (cell_w, cell_h) = downsample_grid(z, DISPLAY_OVERSAMPLE * plot_W)
     fig.add_trace(go.Heatmap(
-        z=z,
+        z=z_display,
+        # Centres des cellules en px de l'affiche
+        x0=(cell_w - 1) / 2,
+        dx=cell_w,
+        y0=(cell_h - 1) / 2,
+        dy=cell_h,
         opacity=1,
         showlegend=False,
         hoverinfo='skip',
         showscale=False,
-        colorscale=[
-            [0.0, "rgba(255,255,255,0.0)"],
-            [0.2, "rgba(0,0,255,0.4)"],
-            [0.4, "rgba(0,255,0,0.9)"],
-            [0.6, "rgba(255,255,0,0.9)"],
-            [0.8, "rgba(255,165,0,0.9)"],
-            [1.0, "rgba(255,0,0,0.9)"]
-        ]
+        colorscale=HEATMAP_COLORSCALE
     ))
 
-    # Ajuster les axes pour correspondre à l'image
-    fig.update_xaxes(range=[0, W], showgrid=False, zeroline=False, visible=False)
-    fig.update_yaxes(range=[0, H], showgrid=False, zeroline=False, visible=False, scaleanchor="x")
+    fig.show()
+
 
-    # Rendu propre : enlever marges
-    fig.update_layout(
-        template="plotly_dark",
-        margin=dict(l=0, r=0, t=0, b=0),
-        width=plot_W,
-        height=int(plot_W * (H / W)),
-        showlegend=False)
 
-    fig.show()
\ No newline at end of file
+def _parse_rgba(color):
+    """ "rgba(r,g,b,a)" -> (r, g, b, a) avec a dans [0, 1]"""
+    values = color[color.index("(") + 1:color.index(")")].split(",")
+    r, g, b = (float(v) for v in values[:3])
+    a = float(values[3]) if len(values) > 3 else 1.0
+    return r, g, b, a
+
+
+def colorscale_lut(colorscale=HEATMAP_COLORSCALE, n=256):
+    """
+    Table de couleurs (n, 4) RGBA float32 (r, g, b en 0..255, a en 0..1) interpolée linéairement
+    entre les paliers de la palette Plotly, comme le fait go.Heatmap.
+    """
+    stops = np.array([s for s, _ in colorscale], dtype=np.float32)
+    colors = np.array([_parse_rgba(c) for _, c in colorscale], dtype=np.float32)
+    t = np.linspace(0.0, 1.0, n, dtype=np.float32)
+    return np.stack([np.interp(t, stops, colors[:, c]) for c in range(4)], axis=1).astype(np.float32)
+
+
+def blend_heat_map(poster_bgr, z, lut=None):
+    """
+    Superpose la densité z sur l'affiche (BGR, uint8) avec la palette de show_heat_map_on_poster.
+    z suit la convention de Plotly (ligne 0 en bas de l'affiche) et est normalisée entre son
+    min et son max ; elle est redimensionnée à la taille de l'image si besoin.
+    """
+    lut = colorscale_lut() if lut is None else lut
+    h, w = poster_bgr.shape[:2]
+    z = np.asarray(z, dtype=np.float32)[::-1]  # ligne 0 en haut, comme l'image
+    if z.shape != (h, w):
+        z = cv2.resize(np.ascontiguousarray(z), (w, h), interpolation=cv2.INTER_LINEAR)
+
+    z_min, z_max = float(z.min()), float(z.max())
+    if z_max <= z_min:
+        return poster_bgr.copy()
+    idx = ((z - z_min) * ((len(lut) - 1) / (z_max - z_min))).astype(np.intp)
+    rgba = lut[idx]
+    alpha = rgba[..., 3:4]
+    color_bgr = rgba[..., 2::-1]
+    out = poster_bgr.astype(np.float32) * (1.0 - alpha) + color_bgr * alpha
+    return np.clip(out + 0.5, 0, 255).astype(np.uint8)
+
+
+def export_heat_map(affiche_path, z, output_path, max_side=None, quality=JPEG_QUALITY):
+    """
+    Écrit l'affiche avec sa heatmap dans output_path (PNG ou JPEG selon l'extension).
+    max_side : plus grand côté de l'image écrite (None = pleine résolution de l'affiche).
+    """
+    poster = cv2.imread(str(affiche_path), cv2.IMREAD_COLOR)
+    if poster is None:
+        raise FileNotFoundError(f"Impossible de lire {affiche_path}")
+    if max_side is not None and max(poster.shape[:2]) > max_side:
+        scale = max_side / max(poster.shape[:2])
+        poster = cv2.resize(poster, (round(poster.shape[1] * scale), round(poster.shape[0] * scale)),
+                            interpolation=cv2.INTER_AREA)
+        z, _ = downsample_grid(z, max_side)
+
+    image = blend_heat_map(poster, z)
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if Path(output_path).suffix.lower() in (".jpg", ".jpeg") else []
+    if not cv2.imwrite(str(output_path), image, params):
+        raise RuntimeError(f"Impossible d'écrire {output_path}")
+    return str(output_path)
@@ -0,0 +1,75 @@
+import os
+import multiprocessing
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from heat_map import heat_map_density, export_heat_map
+from heat_map_utils import traitement_points
+from heat_map_store import HeatmapStore, HEATMAP_DIR
+from projection import poster_sizes
+from ptsInteretPosterImages import POSTERS_DIR, IMAGE_EXTENSIONS
+
+# Export des heatmaps en images (sans navigateur ni affichage)
+EXPORT_DIR = "output/heatmaps_img"
+
+
+def _export_task(affiche_path: str, output_path: str, store_dir: Optional[str], sujet: Optional[str],
+                 points, size: Optional[Tuple[int, int]], distance: int, max_side: Optional[int]) -> str:
+    """
+    Tâche d'un processus du pool : la densité est relue depuis le store (memory-map,
+    rien n'est transféré entre processus) ou calculée à partir des points.
+    size : (W, H) de l'affiche, nécessaire seulement avec des points.
+    """
+    if points is None:
+        z = HeatmapStore(store_dir).layer(Path(affiche_path).name, sujet)
+    else:
+        W, H = size
+        x, y = traitement_points(points[0], points[1], W, H)
+        z = heat_map_density(x, y, W, H, distance)
+    return export_heat_map(affiche_path, z, output_path, max_side)
+
+
+def export_all_heat_maps(poster_dir: str = POSTERS_DIR, output_dir: str = EXPORT_DIR, fmt: str = "png",
+                         store_dir: str = HEATMAP_DIR, sujet: Optional[str] = None,
+                         points_by_poster: Optional[Dict[str, tuple]] = None, distance: int = 300,
+                         max_side: Optional[int] = None, workers: Optional[int] = None) -> List[str]:
+    """
+    Exporte la heatmap de chaque affiche de poster_dir en image, un processus par affiche.
+    Densités lues dans le store (couche sujet, ou combinée si sujet=None) ; les affiches sans
+    couche sont ignorées. points_by_poster ({nom de fichier: (x, y)}) remplace le store.
+    Renvoie les chemins des images écrites.
+    """
+    store = HeatmapStore(store_dir)
+    stored = set(store.posters())
+    # Tailles lues dans l'en-tête des images, sans les décoder
+    sizes = poster_sizes(poster_dir) if points_by_poster is not None else {}
+    tasks = []
+    for affiche_path in sorted(Path(poster_dir).glob("*")):
+        if affiche_path.suffix.lower() not in IMAGE_EXTENSIONS:
+            continue
+        if points_by_poster is not None:
+            points = points_by_poster.get(affiche_path.name)
+            if points is None:
+                continue
+        else:
+            points = None
+            if affiche_path.stem not in stored or (sujet is not None and sujet not in store.layers(affiche_path.stem)):
+                continue
+        output_path = Path(output_dir) / f"{affiche_path.stem}_{sujet or 'combined'}.{fmt}"
+        tasks.append((str(affiche_path), str(output_path), store_dir, sujet, points,
+                      sizes.get(affiche_path.name), distance, max_side))
+
+    if not tasks:
+        print(f"[INFO] Aucune heatmap à exporter depuis {poster_dir}")
+        return []
+
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    # spawn : un enfant forké peut se bloquer sur le pool de threads OpenCV hérité du parent
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        written = list(pool.map(_export_task, *zip(*tasks)))
+    print(f"[INFO] {len(written)} heatmaps écrites dans {output_dir}")
+    return written
+
+
+if __name__ == "__main__":
+    export_all_heat_maps()
@@ -0,0 +1,204 @@
+import os
+import json
+import cv2
+import numpy as np
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+from heat_map import heat_map_density
+from heat_map_utils import traitement_points
+
+# Stockage des heatmaps agrégées : un dossier par affiche, une grille de densité
+# (float32, H x W, en .npy memory-mappé) par sujet, plus une couche "combined" = somme des sujets
+HEATMAP_DIR = "output/heatmaps"
+COMBINED = "combined"
+DENSITY_DISTANCE = 300  # diamètre du cône (px), comme step_heat_map
+TILE_SIZE = 256
+
+
+class HeatmapStore:
+    """
+    Densités de regard par affiche, agrégées sur plusieurs sujets.
+    {root}/{affiche}/meta.json        taille de l'affiche, distance, nb de points par couche
+    {root}/{affiche}/{sujet}.npy      densité du sujet
+    {root}/{affiche}/combined.npy     somme de toutes les couches sujet
+    La densité étant linéaire en les points, chaque ajout ne calcule que la densité des
+    nouveaux points et l'ajoute (en place, dans le memmap) à la couche du sujet et à combined.
+    Un seul processus doit écrire dans le store (par ex. le processus principal de detect_all_subjects).
+    """
+
+    def __init__(self, root: str = HEATMAP_DIR, distance: int = DENSITY_DISTANCE):
+        self.root = Path(root)
+        self.distance = distance
+
+    # --- métadonnées ------------------------------------------------------
+
+    def _poster_dir(self, poster: str) -> Path:
+        return self.root / Path(poster).stem
+
+    def _meta_path(self, poster: str) -> Path:
+        return self._poster_dir(poster) / "meta.json"
+
+    def meta(self, poster: str) -> Dict[str, Any]:
+        with open(self._meta_path(poster), "r") as f:
+            return json.load(f)
+
+    def _save_meta(self, poster: str, meta: Dict[str, Any]):
+        path = self._meta_path(poster)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f, indent=2)
+        os.replace(tmp, path)
+
+    def posters(self) -> List[str]:
+        return sorted(p.parent.name for p in self.root.glob("*/meta.json"))
+
+    def layers(self, poster: str) -> List[str]:
+        """Sujets qui ont une couche pour cette affiche"""
+        return sorted(self.meta(poster)["layers"])
+
+    def _sources_path(self) -> Path:
+        return self.root / "sources.json"
+
+    def source_key(self, sujet: str) -> Optional[str]:
+        """Clé des données d'origine des couches du sujet (voir set_source_key), None si inconnue"""
+        path = self._sources_path()
+        if not path.exists():
+            return None
+        with open(path, "r") as f:
+            return json.load(f).get(sujet)
+
+    def set_source_key(self, sujet: str, key: str):
+        """
+        Enregistre la clé (par ex. l'empreinte des détections) dont sont issues les couches du sujet,
+        une fois toutes ses couches à jour : on peut ensuite sauter une mise à jour identique
+        """
+        path = self._sources_path()
+        sources = {}
+        if path.exists():
+            with open(path, "r") as f:
+                sources = json.load(f)
+        sources[sujet] = key
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(sources, f, indent=2)
+        os.replace(tmp, path)
+
+    # --- grilles ----------------------------------------------------------
+
+    @staticmethod
+    def _check_sujet(sujet: str):
+        """Un sujet ne peut pas porter le nom de la couche combinée (son fichier l'écraserait)"""
+        if sujet == COMBINED:
+            raise ValueError(f'"{COMBINED}" est réservé à la couche combinée, pas un nom de sujet valide')
+
+    def _grid(self, poster: str, layer: str, size=None, mode: str = "r+") -> np.memmap:
+        """Grille memory-mappée d'une couche, créée à zéro si size est donné et qu'elle n'existe pas"""
+        path = self._poster_dir(poster) / f"{layer}.npy"
+        if not path.exists():
+            if size is None:
+                raise FileNotFoundError(f"Pas de couche {layer} pour {poster}")
+            W, H = size
+            grid = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(H, W))
+            grid.flush()
+            return grid
+        return np.load(path, mmap_mode=mode)
+
+    def layer(self, poster: str, sujet: Optional[str] = None) -> np.memmap:
+        """Densité (lecture seule, memory-mappée) d'un sujet, ou de tous les sujets si sujet=None"""
+        if sujet is not None:
+            self._check_sujet(sujet)
+        return self._grid(poster, sujet or COMBINED, mode="r")
+
+    def add_points(self, poster: str, size, sujet: str, x, y, replace: bool = False) -> int:
+        """
+        Ajoute des points de regard (coordonnées pixel de l'affiche) à la couche du sujet
+        et à la couche combinée. size : (W, H) de l'affiche.
+        replace=True remplace la couche du sujet (retraitement d'un sujet) au lieu d'ajouter.
+        Renvoie le nombre de points pris en compte.
+        """
+        self._check_sujet(sujet)
+        W, H = size
+        poster_dir = self._poster_dir(poster)
+        poster_dir.mkdir(parents=True, exist_ok=True)
+        if self._meta_path(poster).exists():
+            meta = self.meta(poster)
+            if tuple(meta["size"]) != (W, H) or meta["distance"] != self.distance:
+                raise ValueError(f"Store de {poster} créé pour size={meta['size']}, distance={meta['distance']}")
+        else:
+            meta = {"poster": poster, "size": [W, H], "distance": self.distance, "layers": {}}
+
+        x, y = traitement_points(x, y, W, H)
+        n_points = int(np.count_nonzero(~np.isnan(x)))
+        z = heat_map_density(x, y, W, H, self.distance).astype(np.float32)
+
+        grid = self._grid(poster, sujet, size)
+        combined = self._grid(poster, COMBINED, size)
+        if replace:
+            combined -= grid
+            grid[:] = z
+            meta["layers"][sujet] = 0
+        else:
+            grid += z
+        combined += z
+        np.maximum(combined, 0, out=combined)  # arrondis de la soustraction
+        grid.flush()
+        combined.flush()
+        del grid, combined
+
+        meta["layers"][sujet] = meta["layers"].get(sujet, 0) + n_points
+        self._save_meta(poster, meta)
+        return n_points
+
+    def remove_layer(self, poster: str, sujet: str):
+        """Retire un sujet (sa densité est soustraite de la couche combinée)"""
+        self._check_sujet(sujet)
+        meta = self.meta(poster)
+        grid = self._grid(poster, sujet, mode="r")
+        combined = self._grid(poster, COMBINED)
+        combined -= grid
+        np.maximum(combined, 0, out=combined)
+        combined.flush()
+        del grid, combined
+        (self._poster_dir(poster) / f"{sujet}.npy").unlink()
+        meta["layers"].pop(sujet, None)
+        self._save_meta(poster, meta)
+
+    # --- tuiles -----------------------------------------------------------
+
+    def export_tiles(self, poster: str, sujet: Optional[str] = None, tile_size: int = TILE_SIZE,
+                     output_dir: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Pyramide de tuiles d'une couche : niveau 0 en pleine résolution, chaque niveau suivant
+        réduit d'un facteur 2 (moyenne, cv2.INTER_AREA) jusqu'à tenir dans une seule tuile.
+        Tuiles en .npy float32 (densité brute) dans {output_dir}/{niveau}/{ty}_{tx}.npy,
+        plus tiles.json (tailles des niveaux, max global pour normaliser les couleurs).
+        """
+        layer = sujet or COMBINED
+        output_dir = Path(output_dir) if output_dir else self._poster_dir(poster) / "tiles" / layer
+        grid = self.layer(poster, sujet)
+
+        levels = []
+        level_img = grid
+        level = 0
+        while True:
+            h, w = level_img.shape
+            level_dir = output_dir / str(level)
+            level_dir.mkdir(parents=True, exist_ok=True)
+            for ty in range(0, h, tile_size):
+                for tx in range(0, w, tile_size):
+                    tile = np.ascontiguousarray(level_img[ty:ty + tile_size, tx:tx + tile_size])
+                    np.save(level_dir / f"{ty // tile_size}_{tx // tile_size}.npy", tile)
+            levels.append({"level": level, "width": w, "height": h,
+                           "tiles_x": -(-w // tile_size), "tiles_y": -(-h // tile_size),
+                           "max": float(level_img.max()) if level_img.size else 0.0})
+            if max(h, w) <= tile_size:
+                break
+            level_img = cv2.resize(np.asarray(level_img), (max(1, w // 2), max(1, h // 2)),
+                                   interpolation=cv2.INTER_AREA)
+            level += 1
+
+        info = {"poster": poster, "layer": layer, "tile_size": tile_size, "levels": levels}
+        with open(output_dir / "tiles.json", "w") as f:
+            json.dump(info, f, indent=2)
+        return info
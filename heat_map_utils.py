@@ -35,17 +35,18 @@ def get_test_set(W, H):
 
 
 def traitement_points(x, y, W, H):
-    # S'assurer que les points sont dans les limites de l'image
-    # et ajouter un NaN pour les points hors limites
-    x_valid = []
-    y_valid = []
-    for i in range(len(x)):
-        if 0 <= x[i] < W and 0 <= y[i] < H:
-            x_valid.append(x[i])
-            y_valid.append(y[i])
-        else:
-            if len(x_valid) >= 1 and x_valid[-1] != np.nan:
-                x_valid.append(np.nan)
-                y_valid.append(np.nan)
-    
-    return x, y
\ No newline at end of file
+    # Garder les points dans les limites de l'image et remplacer
+    # chaque suite de points hors limites par un seul NaN (coupure du tracé)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    inside = (x >= 0) & (x < W) & (y >= 0) & (y < H)
+    # Coupure au premier point hors limites qui suit un point valide
+    coupure = np.zeros_like(inside)
+    coupure[1:] = ~inside[1:] & inside[:-1]
+
+    garder = inside | coupure
+    x_valid = np.where(coupure, np.nan, x)[garder]
+    y_valid = np.where(coupure, np.nan, y)[garder]
+
+    return x_valid, y_valid
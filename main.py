@@ -1,51 +1,157 @@
 import cv2
 import os
+import multiprocessing
 import numpy as np
 import pandas as pd
 from pathlib import Path
 from dataclasses import dataclass, asdict
 from typing import List, Dict, Any, Optional
-from ptsInteretPosterImages import load_posters
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from ptsInteretPosterImages import load_posters, POSTERS_DIR
+from ptsInteretFixations import iter_fixation_features
+import match_images
+import ptsInteretPosterImages
+from match_images import PosterIndex, PosterTracker, match_fixation, create_detector
+from structures import PosterDetection, PosterDetections, array_to_keypoints
+from detection_writer import DetectionWriter
 from convert_to_sql import csv_to_sqlite
-from heat_map import step_heat_map
+from heat_map import show_heat_map_on_poster
+from heat_map_store import HeatmapStore
+from projection import poster_sizes, project_sujet
+from profiling import PROFILER
 
 WORKING_DIR = "data"
 SUJET_NAMES = ["sujet1_f-42e0d11a", "sujet2_f-835bf855", "sujet3_m-84ce1158", "sujet4_m-fee537df", "sujet5_m-671cf44e", "sujet6_m-0b355b51"]
 VIDEO_FILEMNAMES = ["e0b2c246_0.0-138.011.mp4", "b7bd6c34_0.0-271.583.mp4", "422f10f2_0.0-247.734.mp4", "2fb8301a_0.0-71.632.mp4", "585d8df7_0.0-229.268.mp4", "429d311a_0.0-267.743.mp4"]
-POSTERS_DIR = f"{WORKING_DIR}/Affiches"
 OUTPUT_DETECTIONS_CSV = "output/poster_detections.csv"
+# Détections par sujet écrites au fil de l'eau, avec point de reprise (voir DetectionWriter)
+DETECTIONS_DIR = "output/detections"
+DETECTIONS_FORMAT = "csv"  # "csv", "sqlite" ou "parquet" (pyarrow)
+PROFILE_DIR = "output/profiling"
 
 # Taille de la ROI autour du regard (en pixels)
 ROI_WIDTH = 400
 ROI_HEIGHT = 400
 
+# Détecteur de features : "sift" (référence), "orb" ou "akaze" (plus rapides, moins de rappel)
+FEATURE_BACKEND = "sift"
 
+# Nombre de processus pour le traitement de tous les sujets (None = nb de coeurs)
+N_WORKERS = None
+
+def detection_params(backend: str, tracking: bool) -> Dict[str, Any]:
+    """Paramètres dont dépendent les détections, gardés dans le checkpoint (voir DetectionWriter)"""
+    return {
+        "backend": backend,
+        "tracking": tracking,
+        "crop_size": match_images.BACKEND_CROP_SIZES[backend],
+        "min_matches": match_images.MIN_MATCHES,
+        "min_inliers": match_images.MIN_INLIERS,
+        "confident_inliers": match_images.CONFIDENT_INLIERS,
+        "max_candidates": match_images.MAX_CANDIDATES,
+        "ransac_threshold": match_images.RANSAC_THRESHOLD,
+        "ref_max_side": ptsInteretPosterImages.REF_MAX_SIDE,
+        "ref_levels": ptsInteretPosterImages.REF_LEVELS,
+        "keypoint_budget": ptsInteretPosterImages.KEYPOINT_BUDGET,
+    }
+
+
+# Points projetés sur les affiches pour les heatmaps : "gaze" (regard pendant la fixation) ou "fixation"
+HEATMAP_SOURCE = "gaze"
+
+
+def update_heat_maps(sujet_index: int, detections: PosterDetections, show: bool = False,
+                     source: str = HEATMAP_SOURCE) -> Dict[str, int]:
+    """
+    Projette le regard des détections du sujet sur les affiches (homographie de chaque détection)
+    et remplace les couches du sujet dans le HeatmapStore. Rien n'est recalculé si les couches
+    viennent déjà de ces mêmes détections (reprise d'un sujet terminé).
+    show : affiche ensuite la heatmap du sujet pour chaque affiche (navigateur).
+    Écrit dans le store : à appeler depuis un seul processus.
+    Renvoie le nombre de points pris en compte par affiche.
+    """
+    sujet = SUJET_NAMES[sujet_index]
+    store = HeatmapStore()
+    key = f"{source}:{detections.fingerprint()}"
+    if store.source_key(sujet) != key:
+        sizes = poster_sizes(POSTERS_DIR)
+        points = project_sujet(f"{WORKING_DIR}/database{sujet_index+1}.sqlite", f"{WORKING_DIR}/{sujet}",
+                               detections, sizes, source)
+        for poster_name, (x, y) in points.items():
+            store.add_points(poster_name, sizes[poster_name], sujet, x, y, replace=True)
+        # Affiches qui ne sont plus regardées par le sujet
+        seen = {Path(name).stem for name in points}
+        for poster in store.posters():
+            if poster not in seen and sujet in store.layers(poster):
+                store.remove_layer(poster, sujet)
+        store.set_source_key(sujet, key)
+
+    n_points = {}
+    for poster in store.posters():
+        meta = store.meta(poster)
+        if sujet not in meta["layers"]:
+            continue
+        n_points[meta["poster"]] = meta["layers"][sujet]
+        if show:
+            show_heat_map_on_poster(Path(POSTERS_DIR) / meta["poster"], store.layer(poster, sujet))
+    return n_points
+
+
+def detect_posters_in_video(display = False, sujet_index: int = 0, heat_map: bool = True, tracking: bool = True,
+                            profile: bool = False, progress_every: int = 0,
+                            backend: str = FEATURE_BACKEND, resume: bool = True,
+                            output_format: str = DETECTIONS_FORMAT, verbose: bool = True,
+                            show_heat_maps: bool = False, n_threads: Optional[int] = None) -> PosterDetections:
+    """
+    Détecte les affiches regardées pendant les fixations d'un sujet.
+    Les détections sont écrites par lots dans DETECTIONS_DIR ; avec resume=True, une exécution
+    interrompue reprend après la dernière fixation du checkpoint (et un sujet terminé n'est pas refait),
+    si le backend et les paramètres de matching sont les mêmes (sinon le sujet est recommencé).
+    heat_map : met à jour les couches du sujet dans le HeatmapStore (show_heat_maps : et les affiche).
+    n_threads : threads SIFT (None = nb de coeurs, voir iter_fixation_features).
+    Renvoie toutes les détections du sujet.
+    """
 
-def detect_posters_in_video(display = False, sujet_index: int = 0):
-    
     Path(OUTPUT_DETECTIONS_CSV).parent.mkdir(parents=True, exist_ok=True) #dossier de sortie si necessaire
 
-    sift = cv2.SIFT_create()
-    bf = cv2.BFMatcher(cv2.NORM_L2, crossCheck=False)
+    # Instrumentation : temps par étape et compteurs, rapport dans PROFILE_DIR
+    PROFILER.enabled = profile
+    PROFILER.progress_every = progress_every
+    PROFILER.reset()
+
+    sujet = SUJET_NAMES[sujet_index]
+    writer = DetectionWriter(DETECTIONS_DIR, sujet, output_format, resume=resume,
+                             params=detection_params(backend, tracking))
+    if writer.done:
+        print(f"[INFO] {sujet} déjà traité (checkpoint), détections relues depuis {writer.path}")
+        detections = writer.read()
+        if heat_map:
+            update_heat_maps(sujet_index, detections, show=show_heat_maps)
+        return detections
+    if writer.last_fixation_id >= 0:
+        print(f"[INFO] Reprise de {sujet} après la fixation {writer.last_fixation_id}")
+
+    detector = create_detector(backend)
+    db_path = f"{WORKING_DIR}/database{sujet_index+1}.sqlite"
 
     # Création de la DB SQLite si elle n'existe pas déjà
-    if not os.path.exists(f"{WORKING_DIR}/database{sujet_index+1}.sqlite"):
+    if not os.path.exists(db_path):
         print(f"[INFO] Création de la DB SQLite pour le sujet {sujet_index+1}...")
-        csv_to_sqlite(f"{WORKING_DIR}/{SUJET_NAMES[sujet_index]}", f"{WORKING_DIR}/database{sujet_index+1}.sqlite", display)
+        csv_to_sqlite(f"{WORKING_DIR}/{SUJET_NAMES[sujet_index]}", db_path, display)
 
     # 1) Posters
-    posters = load_posters(POSTERS_DIR, sift)
+    posters = load_posters(POSTERS_DIR, detector)
     if not posters:
         print(f"[ERROR] Aucun poster chargé, vérifie {POSTERS_DIR}")
-        return
+        return PosterDetections()
     
     if display:
         # Affichage des posters chargés avec par dessus les points d'intérêt détectés
         for poster in posters:
             img_path = Path(POSTERS_DIR) / poster.name
             img = cv2.imread(str(img_path), cv2.IMREAD_COLOR)
-            img_kp = cv2.drawKeypoints(img, poster.kp, None,flags=cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS)
-            #img_kp = cv2.drawKeypoints(img, poster.kp, None)  # sans flags
+            img_kp = cv2.drawKeypoints(img, array_to_keypoints(poster.kp), None,flags=cv2.DRAW_MATCHES_FLAGS_DRAW_RICH_KEYPOINTS)
+            #img_kp = cv2.drawKeypoints(img, array_to_keypoints(poster.kp), None)  # sans flags
 
             h, w = img_kp.shape[:2]
             max_size = 800  # taille max pour l’affichage
@@ -61,13 +167,132 @@ def detect_posters_in_video(display = False, sujet_index: int = 0):
         cv2.destroyAllWindows()
 
     # 2) Vidéo et fixations
+    fixations = iter_fixation_features(
+        f"{WORKING_DIR}/{SUJET_NAMES[sujet_index]}",
+        db_path=db_path,
+        video_filename=VIDEO_FILEMNAMES[sujet_index],
+        backend=backend,
+        start_after=writer.last_fixation_id,
+        n_threads=n_threads,
+        verbose=verbose,
+    )
+    index = PosterIndex.from_posters(posters)
+
+    # Vérification par homographie RANSAC, affiches testées par votes décroissants.
+    # Avec le suivi, on tente d'abord l'affiche de la fixation précédente.
+    tracker = PosterTracker(index, posters)
+    n_detections = 0
+    with writer:
+        for fix in fixations:
+            result = tracker.match(fix) if tracking else match_fixation(index, posters, fix)
+            if result is not None:
+                detection, H = result
+                writer.write(detection)
+                n_detections += 1
+            writer.mark_processed(fix["fix_index"])
+        writer.finish()
+    if tracking:
+        print(f"[INFO] Suivi : {tracker.n_tracked} fixations sans matching complet, {tracker.n_full} avec")
+    PROFILER.count("detections", n_detections)
+    # Tableau structuré : compact en mémoire et rapide à renvoyer depuis un processus du pool
+    detections = writer.read()
+
+    if profile:
+        report_path = f"{PROFILE_DIR}/{SUJET_NAMES[sujet_index]}"
+        PROFILER.write_json(f"{report_path}.json")
+        PROFILER.write_csv(f"{report_path}.csv")
+        print(f"[PROFIL] {SUJET_NAMES[sujet_index]}\n{PROFILER.summary()}")
+
+    # 3) Heatmap : regard projeté dans le repère de chaque affiche regardée
+    if heat_map:
+        update_heat_maps(sujet_index, detections, show=show_heat_maps)
+
+    return detections
+
+
+def _detect_sujet(sujet_index: int, profile: bool = False, progress_every: int = 0,
+                  backend: str = FEATURE_BACKEND, resume: bool = True, verbose: bool = True,
+                  n_threads: int = 1) -> PosterDetections:
+    """
+    Tâche exécutée dans un processus du pool.
+    Chaque processus ouvre ses propres connexions SQLite (sur la DB de son sujet),
+    rien n'est partagé avec le processus principal.
+    n_threads : part des coeurs de ce processus, pour les threads SIFT ; le pool interne
+    d'OpenCV est limité à 1 thread (sinon chaque processus en lance un par coeur).
+    """
+    cv2.setNumThreads(1)
+    return detect_posters_in_video(display=False, sujet_index=sujet_index, heat_map=False,
+                                   profile=profile, progress_every=progress_every, backend=backend,
+                                   resume=resume, verbose=verbose, n_threads=n_threads)
+
+
+def write_detections_csv(detections_by_sujet: Dict[int, PosterDetections], output_csv: str = OUTPUT_DETECTIONS_CSV):
+    """
+    Fusionne les détections de tous les sujets dans un seul CSV.
+    L'ordre est déterministe : sujets dans l'ordre de SUJET_NAMES, puis fixation_id,
+    quel que soit l'ordre de fin des processus.
+    """
+    frames = []
+    for sujet_index in sorted(detections_by_sujet):
+        detections = detections_by_sujet[sujet_index]
+        detections = detections[np.argsort(detections["fixation_id"], kind="stable")]
+        df = detections.to_dataframe().astype({"poster_name": str, "backend": str})
+        df.insert(0, "sujet", SUJET_NAMES[sujet_index])
+        frames.append(df)
+
+    columns = ["sujet"] + list(PosterDetection.__dataclass_fields__)
+    df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+    Path(output_csv).parent.mkdir(parents=True, exist_ok=True)
+    df[columns].to_csv(output_csv, index=False)
+    print(f"[INFO] {len(df)} détections écrites dans {output_csv}")
+
+
+def detect_all_subjects(workers: Optional[int] = N_WORKERS, sujet_indices: Optional[List[int]] = None,
+                        profile: bool = False, progress_every: int = 0,
+                        backend: str = FEATURE_BACKEND, resume: bool = True,
+                        heat_map: bool = True, verbose: bool = True) -> Dict[int, PosterDetections]:
+    """
+    Traite tous les sujets en parallèle (un sujet par tâche dans un pool de processus)
+    puis écrit toutes les détections dans OUTPUT_DETECTIONS_CSV.
+    resume : relancé après un arrêt, les sujets terminés ne sont pas refaits et les autres
+    reprennent à leur checkpoint (resume=False recommence tout)
+    profile : un rapport par sujet dans PROFILE_DIR (plus batch.json pour l'écriture finale)
+    verbose : affiche le nombre de keypoints de chaque fixation
+    heat_map : met à jour le HeatmapStore avec le regard projeté de chaque sujet (processus principal)
+    """
+    if sujet_indices is None:
+        sujet_indices = list(range(len(SUJET_NAMES)))
+
+    PROFILER.enabled = profile
+    PROFILER.reset()
+
+    # Coeurs partagés entre les processus : workers x n_threads threads au total
+    workers = min(workers or os.cpu_count() or 1, len(sujet_indices)) or 1
+    n_threads = max(1, (os.cpu_count() or 1) // workers)
+
+    detections_by_sujet: Dict[int, PosterDetections] = {}
+    # spawn : un enfant forké peut se bloquer sur le pool de threads OpenCV hérité du parent
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(_detect_sujet, i, profile, progress_every, backend, resume, verbose, n_threads): i
+                   for i in sujet_indices}
+        for done, future in enumerate(as_completed(futures), start=1):
+            sujet_index = futures[future]
+            detections_by_sujet[sujet_index] = future.result()
+            print(f"[{done}/{len(futures)}] {SUJET_NAMES[sujet_index]} : "
+                  f"{len(detections_by_sujet[sujet_index])} détections")
 
-    # 3) Heatmap
-    x = [1000]
-    y = [1000]
-    poster_name = "Bell"
-    step_heat_map(x, y, poster_name)
+    with PROFILER.stage("write"):
+        write_detections_csv(detections_by_sujet)
+    if heat_map:
+        with PROFILER.stage("heat_map"):
+            for sujet_index in sorted(detections_by_sujet):
+                update_heat_maps(sujet_index, detections_by_sujet[sujet_index])
+    if profile:
+        PROFILER.write_json(f"{PROFILE_DIR}/batch.json")
+    return detections_by_sujet
 
 
 if __name__ == "__main__":
-    detect_posters_in_video()
+    # Tous les sujets en parallèle :
+    # detect_all_subjects(workers=4)
+    detect_posters_in_video(show_heat_maps=True)
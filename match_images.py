@@ -1,10 +1,49 @@
 import cv2
 import numpy as np
+from structures import PosterDetection, homography_fields
+from profiling import PROFILER
 
+FLANN_INDEX_KDTREE = 1
+FLANN_INDEX_LSH = 6
+
+# Détecteurs disponibles : SIFT (float, L2) et détecteurs binaires (Hamming, index LSH),
+# plus rapides mais avec moins de rappel
+FEATURE_BACKENDS = {
+    "sift": lambda: cv2.SIFT_create(),
+    # patchSize/edgeThreshold <= taille du crop / 4, sinon ORB ne garde presque aucun point
+    "orb": lambda: cv2.ORB_create(nfeatures=2000, edgeThreshold=31, patchSize=31, fastThreshold=20),
+}
+if hasattr(cv2, "AKAZE_create"):  # absent de certaines versions d'OpenCV
+    FEATURE_BACKENDS["akaze"] = lambda: cv2.AKAZE_create()
+
+# Taille du crop autour de la fixation (px) : les détecteurs binaires ont besoin d'un
+# contexte plus large que SIFT pour trouver assez de points sur l'affiche
+BACKEND_CROP_SIZES = {"sift": 100, "orb": 200, "akaze": 200}
+
+# Vérification géométrique (homographie RANSAC)
+MIN_MATCHES = 4          # nombre minimal de matches pour estimer une homographie
+MIN_INLIERS = 8          # inliers minimum pour accepter une affiche
+CONFIDENT_INLIERS = 20   # au-delà, on arrête la cascade sans tester les autres affiches
+MAX_CANDIDATES = 3       # nombre max d'affiches vérifiées par fixation
+RANSAC_THRESHOLD = 5.0   # erreur de reprojection max (px)
+TRACK_GATE_PX = 150.0    # suivi : écart max (px) entre un match et sa position prédite par l'homographie précédente
+
+
+def create_detector(backend="sift"):
+    """Détecteur du backend demandé ("sift", "orb" ou "akaze")"""
+    if backend == "akaze" and backend not in FEATURE_BACKENDS:
+        raise RuntimeError("AKAZE n'est pas disponible dans cette version d'OpenCV")
+    if backend not in FEATURE_BACKENDS:
+        raise ValueError(f"Backend inconnu : {backend} (disponibles : {', '.join(FEATURE_BACKENDS)})")
+    return FEATURE_BACKENDS[backend]()
+
+def create_sift():
+    """Détecteur SIFT utilisé pour le matching (mêmes paramètres pour posters et vidéo)"""
+    return cv2.SIFT.create(nfeatures=2000, contrastThreshold=0.03)
 
 def apply_sift(image):
     # Image en niveaux de gris
-    sift = cv2.SIFT.create(nfeatures=2000, contrastThreshold=0.03)
+    sift = create_sift()
     keypoints,descriptors = sift.detectAndCompute(image, None)
     return keypoints, descriptors
 
@@ -49,28 +88,251 @@ def match_and_display(img1, img2, max_matches=50):
     cv2.destroyAllWindows()
     
     
-# Adapter seuil
-def match_all(descriptors_all_orig,descriptors_video,seuil=80):
-    """
-    Fait les matches de l'image de la vidéo avec tous les posters
-    et renvoie le poster avec le plus de matches (-1 si aucun ne convient)
-    descriptors_all_orig : liste des descripteurs de toutes les affiches
-    descriptos_video : descripteur de la vidéo
-    seuil : seuil minimal pour identifier un poster
-    """
-    id_best_match = -1
-    pourcentage_match_max = 0
-    for i in range(len(descriptors_all_orig)):
-        matches = match_keypoints(descriptors_all_orig[i],descriptors_video)
-        pourcentage_match = 100*(len(matches)/max(len(descriptors_all_orig[i]),len(descriptors_video)))
-        print(pourcentage_match)
-        if pourcentage_match > seuil:
-            # faire homographie + match à nouveau pour vérif
-            if pourcentage_match > pourcentage_match_max:
-                pourcentage_match_max = pourcentage_match
-                id_best_match = i
-
-    return id_best_match
-            
-        
-    
\ No newline at end of file
+class PosterIndex:
+    """
+    Index FLANN unique sur les descripteurs de toutes les affiches : KD-tree pour
+    les descripteurs float (SIFT), LSH en distance de Hamming pour les descripteurs
+    binaires (ORB, AKAZE).
+    Les descripteurs sont empilés, labels[j] donne l'affiche du descripteur j
+    et offsets[i] l'indice du premier descripteur de l'affiche i.
+    points (optionnel) : coordonnées (x, y) des keypoints empilés, pour l'homographie.
+    """
+    def __init__(self, descriptors_all_orig, trees=4, checks=32, keypoints_all_orig=None):
+        counts = np.array([len(d) for d in descriptors_all_orig], dtype=np.int64)
+        self.n_posters = len(descriptors_all_orig)
+        self.counts = counts
+        self.offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        self.labels = np.repeat(np.arange(self.n_posters, dtype=np.int32), counts)
+        self.binary = np.asarray(descriptors_all_orig[0]).dtype == np.uint8
+        self.dtype = np.uint8 if self.binary else np.float32
+        self.descriptors = np.vstack([np.asarray(d, dtype=self.dtype) for d in descriptors_all_orig])
+        if self.binary:
+            self.index_params = dict(algorithm=FLANN_INDEX_LSH, table_number=6, key_size=12, multi_probe_level=1)
+        else:
+            self.index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=trees)
+        self.search_params = dict(checks=checks)
+        self.index = cv2.flann_Index(self.descriptors, self.index_params)
+        self._poster_indexes = {}
+        self.points = None
+        if keypoints_all_orig is not None:
+            self.points = np.vstack([keypoints_xy(kp) for kp in keypoints_all_orig])
+
+    @classmethod
+    def from_posters(cls, posters, **kwargs):
+        """Index sur une liste de PosterRef (descripteurs + coordonnées des keypoints)"""
+        return cls([p.des for p in posters], keypoints_all_orig=[p.kp for p in posters], **kwargs)
+
+    def match(self, descriptors_video, ratio=0.75):
+        """
+        Une seule requête kNN (k=2) pour tous les descripteurs de la vidéo.
+        Renvoie (query_idx, train_idx) des correspondances qui passent le ratio test,
+        train_idx étant un indice dans les descripteurs empilés.
+        """
+        if descriptors_video is None or len(descriptors_video) == 0 or len(self.descriptors) < 2:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+        query = np.asarray(descriptors_video, dtype=self.dtype)
+        with PROFILER.stage("match"):
+            idx, dists = self.index.knnSearch(query, 2, params=self.search_params)
+        good = self._ratio_test(idx, dists, ratio)
+        PROFILER.count("matches", int(good.sum()))
+        return np.flatnonzero(good), idx[good, 0].astype(np.int64)
+
+    def _ratio_test(self, idx, dists, ratio):
+        if self.binary:
+            # Hamming : distances brutes ; LSH peut ne pas trouver 2 voisins (indice -1)
+            found = (idx[:, 0] >= 0) & (idx[:, 1] >= 0)
+            return found & (dists[:, 0] < ratio * dists[:, 1])
+        # KD-tree : distances L2 au carré -> ratio au carré
+        return dists[:, 0] < (ratio ** 2) * dists[:, 1]
+
+    def match_poster(self, poster_id, descriptors_video, ratio=0.75):
+        """
+        Comme match, mais contre une seule affiche (index FLANN de l'affiche construit
+        à la première utilisation). train_idx reste un indice dans les descripteurs empilés.
+        """
+        start, count = int(self.offsets[poster_id]), int(self.counts[poster_id])
+        if descriptors_video is None or len(descriptors_video) == 0 or count < 2:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty
+        if poster_id not in self._poster_indexes:
+            self._poster_indexes[poster_id] = cv2.flann_Index(
+                self.descriptors[start:start + count], self.index_params
+            )
+        query = np.asarray(descriptors_video, dtype=self.dtype)
+        with PROFILER.stage("match"):
+            idx, dists = self._poster_indexes[poster_id].knnSearch(query, 2, params=self.search_params)
+        good = self._ratio_test(idx, dists, ratio)
+        PROFILER.count("matches", int(good.sum()))
+        return np.flatnonzero(good), idx[good, 0].astype(np.int64) + start
+
+
+def keypoints_xy(keypoints):
+    """
+    Coordonnées (x, y) des keypoints, en tableau float32 (N, 2).
+    keypoints : tableau empaqueté (N, 6) (voir structures.keypoints_to_array) ou liste de cv2.KeyPoint
+    """
+    if isinstance(keypoints, np.ndarray):
+        return np.ascontiguousarray(keypoints[:, :2], dtype=np.float32)
+    return np.array([k.pt for k in keypoints], dtype=np.float32).reshape(-1, 2)
+
+
+def _ransac_homography(index, query_idx, train_idx, video_xy, ransac_threshold):
+    """Homographie RANSAC affiche -> vidéo et nombre d'inliers (None, 0 si échec)"""
+    if len(query_idx) < MIN_MATCHES:
+        return None, 0
+    src = index.points[train_idx].reshape(-1, 1, 2)
+    dst = video_xy[query_idx].reshape(-1, 1, 2)
+    with PROFILER.stage("ransac"):
+        H, mask = cv2.findHomography(src, dst, cv2.RANSAC, ransac_threshold)
+    PROFILER.count("ransac_runs")
+    if H is None:
+        return None, 0
+    return H, int(mask.sum())
+
+
+def verify_poster(index, poster_id, keypoints_video, descriptors_video, offset=(0, 0),
+                  min_inliers=MIN_INLIERS, ransac_threshold=RANSAC_THRESHOLD,
+                  prior_H=None, gate_px=TRACK_GATE_PX):
+    """
+    Vérifie une seule affiche (hypothèse de suivi).
+    prior_H : homographie de la fixation précédente. Seuls les matches dont le keypoint vidéo
+    est à moins de gate_px de la position prédite par prior_H sont passés à RANSAC.
+    Renvoie (id_poster, H, inliers, total_matches) ou None.
+    total_matches : matches du ratio test contre cette seule affiche, avant le filtrage spatial
+    (même définition que verify_candidates).
+    """
+    query_idx, train_idx = index.match_poster(poster_id, descriptors_video)
+    total_matches = len(query_idx)
+    video_xy = keypoints_xy(keypoints_video) + np.float32(offset)
+    if prior_H is not None and total_matches:
+        predicted = cv2.perspectiveTransform(
+            index.points[train_idx].reshape(-1, 1, 2).astype(np.float64), prior_H
+        ).reshape(-1, 2)
+        near = np.linalg.norm(predicted - video_xy[query_idx], axis=1) <= gate_px
+        query_idx, train_idx = query_idx[near], train_idx[near]
+    H, inliers = _ransac_homography(index, query_idx, train_idx, video_xy, ransac_threshold)
+    if H is None or inliers < min_inliers:
+        return None
+    return int(poster_id), H, inliers, total_matches
+
+
+def verify_candidates(index, keypoints_video, descriptors_video, offset=(0, 0),
+                      min_inliers=MIN_INLIERS, confident_inliers=CONFIDENT_INLIERS,
+                      max_candidates=MAX_CANDIDATES, ransac_threshold=RANSAC_THRESHOLD):
+    """
+    Cascade de vérification : les affiches sont testées par nombre de votes décroissant
+    avec une homographie RANSAC, et on s'arrête dès qu'une affiche atteint confident_inliers.
+    index : PosterIndex construit avec les keypoints (PosterIndex.from_posters)
+    offset : décalage (x0, y0) à ajouter aux keypoints de la vidéo (origine du crop)
+    Renvoie (id_poster, H, inliers, total_matches) ou None si aucune affiche n'est validée.
+    H envoie les coordonnées de l'affiche dans celles de la vidéo (décalées de offset).
+    total_matches : votes de l'affiche retenue (matches de l'index global vers elle),
+    dont les inliers sont un sous-ensemble, donc inliers <= total_matches.
+    """
+    query_idx, train_idx = index.match(descriptors_video)
+    if len(query_idx) < MIN_MATCHES:
+        return None
+
+    labels = index.labels[train_idx]
+    votes = np.bincount(labels, minlength=index.n_posters)
+    video_xy = keypoints_xy(keypoints_video) + np.float32(offset)
+
+    best = None
+    for poster_id in np.argsort(-votes, kind="stable")[:max_candidates]:
+        total_matches = int(votes[poster_id])
+        if total_matches < max(MIN_MATCHES, min_inliers):
+            break  # votes triés : les suivants ont encore moins de matches
+
+        sel = labels == poster_id
+        H, inliers = _ransac_homography(index, query_idx[sel], train_idx[sel], video_xy, ransac_threshold)
+        if H is None:
+            continue
+
+        if best is None or inliers > best[2]:
+            best = (int(poster_id), H, inliers, total_matches)
+        if inliers >= confident_inliers:
+            break
+
+    if best is None or best[2] < min_inliers:
+        return None
+    return best
+
+
+def match_fixation(index, posters, entry, **kwargs):
+    """
+    Vérifie une fixation (entrée renvoyée par SIFT_on_fixations) contre toutes les affiches.
+    Renvoie (PosterDetection, H) ou None, H étant exprimée en coordonnées de la frame undistordue.
+    """
+    result = verify_candidates(index, entry["keypoints"], entry["descriptors"],
+                               offset=entry.get("crop_origin", (0, 0)), **kwargs)
+    if result is None:
+        return None
+    return _detection_from_result(posters, entry, result)
+
+
+def _detection_from_result(posters, entry, result):
+    poster_id, H, inliers, total_matches = result
+    detection = PosterDetection(
+        fixation_id=entry["fix_index"],
+        frame_idx=entry["frame_num"],
+        timestamp=entry["timestamp"],
+        poster_name=posters[poster_id].name,
+        inliers=inliers,
+        total_matches=total_matches,
+        inlier_ratio=inliers / total_matches,
+        x=entry["x"],
+        y=entry["y"],
+        backend=posters[poster_id].backend,
+        **homography_fields(H),
+    )
+    return detection, H
+
+
+class PosterTracker:
+    """
+    Suivi temporel des affiches entre fixations successives.
+    Si la fixation précédente (à moins de max_gap_frames frames) a été détectée,
+    on vérifie d'abord uniquement cette affiche, en ne gardant pour RANSAC que les matches
+    compatibles avec son homographie (à moins de gate_px de la position prédite) ;
+    le matching complet (cascade sur toutes les affiches) n'est fait que si cette hypothèse échoue.
+    """
+    def __init__(self, index, posters, max_gap_frames=30, gate_px=TRACK_GATE_PX, **kwargs):
+        self.index = index
+        self.posters = posters
+        self.max_gap_frames = max_gap_frames
+        self.gate_px = gate_px
+        self.kwargs = kwargs
+        self.last_poster = None
+        self.last_H = None
+        self.last_frame = None
+        self.n_tracked = 0   # fixations validées par le suivi
+        self.n_full = 0      # fixations qui ont nécessité le matching complet
+
+    def match(self, entry):
+        """Même résultat que match_fixation : (PosterDetection, H) ou None"""
+        offset = entry.get("crop_origin", (0, 0))
+        if self.last_poster is not None and entry["frame_num"] - self.last_frame <= self.max_gap_frames:
+            result = verify_poster(self.index, self.last_poster, entry["keypoints"], entry["descriptors"],
+                                   offset=offset,
+                                   min_inliers=self.kwargs.get("min_inliers", MIN_INLIERS),
+                                   ransac_threshold=self.kwargs.get("ransac_threshold", RANSAC_THRESHOLD),
+                                   prior_H=self.last_H, gate_px=self.gate_px)
+            if result is not None:
+                self.n_tracked += 1
+                self.last_H = result[1]
+                self.last_frame = entry["frame_num"]
+                return _detection_from_result(self.posters, entry, result)
+
+        self.n_full += 1
+        result = verify_candidates(self.index, entry["keypoints"], entry["descriptors"],
+                                   offset=offset, **self.kwargs)
+        if result is None:
+            self.last_poster = None
+            self.last_H = None
+            return None
+
+        self.last_poster = result[0]
+        self.last_H = result[1]
+        self.last_frame = entry["frame_num"]
+        return _detection_from_result(self.posters, entry, result)
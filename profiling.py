@@ -0,0 +1,149 @@
+import csv
+import json
+import time
+import threading
+import numpy as np
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional
+
+# Étapes instrumentées du pipeline de détection (dans l'ordre du rapport)
+STAGES = ["seek", "decode", "undistort", "crop", "sift", "match", "ransac", "write"]
+
+
+class Profiler:
+    """
+    Temps par étape et compteurs du pipeline.
+    Chaque appel de stage() est un échantillon (en général une fixation), ce qui donne
+    des percentiles par étape. Les latences de bout en bout (record_latency, par exemple
+    du décodage d'une fixation jusqu'à l'écriture de sa détection) sont gardées à part :
+    elles recouvrent les étapes et n'entrent pas dans leurs parts du temps total.
+    Utilisable depuis plusieurs threads.
+    """
+
+    def __init__(self, enabled: bool = True, progress_every: int = 0):
+        self.enabled = enabled
+        self.progress_every = progress_every  # 0 = pas d'affichage de progression
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.samples: Dict[str, List[float]] = {}
+            self.latencies: Dict[str, List[float]] = {}
+            self.counters: Dict[str, int] = {}
+            self.started = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t)
+
+    def record(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def record_latency(self, name: str, seconds: float):
+        """Latence de bout en bout d'un élément (une fixation...), hors découpage en étapes"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+
+    def count(self, name: str, n: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def progress(self, done: int, total: Optional[int] = None, label: str = "fixations"):
+        """Affiche la progression toutes les progress_every unités"""
+        if not self.enabled or not self.progress_every or done % self.progress_every != 0:
+            return
+        elapsed = time.perf_counter() - self.started
+        total_str = f"/{total}" if total is not None else ""
+        print(f"[PROFIL] {done}{total_str} {label} en {elapsed:.1f} s ({done / elapsed:.1f}/s)")
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = {name: np.array(values) for name, values in self.samples.items()}
+            latencies = {name: np.array(values) for name, values in self.latencies.items()}
+            counters = dict(self.counters)
+        wall = time.perf_counter() - self.started
+        total_all = sum(float(v.sum()) for v in samples.values())
+
+        names = [s for s in STAGES if s in samples] + sorted(set(samples) - set(STAGES))
+        stages = {}
+        for name in names:
+            total = float(samples[name].sum())
+            stages[name] = {
+                "calls": int(len(samples[name])),
+                "total_s": total,
+                "share": total / total_all if total_all > 0 else 0.0,
+                **_percentiles_ms(samples[name]),
+            }
+        latency = {
+            name: {"calls": int(len(values)), **_percentiles_ms(values)}
+            for name, values in sorted(latencies.items())
+        }
+        return {"wall_s": wall, "stages": stages, "latency": latency, "counters": counters}
+
+    def write_json(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def write_csv(self, path: str):
+        """Une ligne par étape, puis une ligne par compteur"""
+        report = self.report()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        fields = ["calls", "total_s", "share", "mean_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms"]
+        with open(path, "w", newline="") as f:
+            w = csv.writer(f)
+            w.writerow(["name"] + fields)
+            for name, stats in report["stages"].items():
+                w.writerow([name] + [stats[k] for k in fields])
+            for name, stats in report["latency"].items():
+                w.writerow([f"latency:{name}"] + [stats.get(k, "") for k in fields])
+            for name, value in report["counters"].items():
+                w.writerow([name, value] + [""] * (len(fields) - 1))
+
+    def summary(self) -> str:
+        report = self.report()
+        lines = [f"Durée totale : {report['wall_s']:.2f} s"]
+        for name, stats in report["stages"].items():
+            lines.append(
+                f"  {name:>10} : {stats['total_s']:8.2f} s ({100 * stats['share']:5.1f} %)  "
+                f"p50 {stats['p50_ms']:7.2f} ms  p90 {stats['p90_ms']:7.2f} ms  p99 {stats['p99_ms']:7.2f} ms"
+            )
+        for name, stats in report["latency"].items():
+            lines.append(
+                f"  {name:>10} : latence de bout en bout ({stats['calls']})  "
+                f"p50 {stats['p50_ms']:7.2f} ms  p90 {stats['p90_ms']:7.2f} ms  p99 {stats['p99_ms']:7.2f} ms"
+            )
+        for name, value in report["counters"].items():
+            lines.append(f"  {name:>10} : {value}")
+        return "\n".join(lines)
+
+
+def _percentiles_ms(seconds: np.ndarray) -> Dict[str, float]:
+    values = seconds * 1000.0  # ms
+    return {
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p90_ms": float(np.percentile(values, 90)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+# Profiler partagé par les modules du pipeline (désactivé par défaut, un par processus)
+PROFILER = Profiler(enabled=False)
@@ -0,0 +1,97 @@
+import cv2
+import numpy as np
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple
+from PIL import Image
+from structures import PosterDetections
+from appelsDB import load_fixations_arrays, load_gaze_arrays
+from undistort import load_camera_calibration, undistort_points
+from ptsInteretPosterImages import IMAGE_EXTENSIONS
+
+# Projection du regard (caméra de scène) dans le repère des affiches détectées.
+# L'homographie d'une détection va des pixels de l'affiche (pleine résolution) vers les pixels
+# de la frame undistordue : on undistord les points puis on applique son inverse.
+SOURCES = ("gaze", "fixation")
+
+
+def poster_sizes(poster_dir: str) -> Dict[str, Tuple[int, int]]:
+    """(W, H) pleine résolution de chaque affiche, par nom de fichier (seul l'en-tête est lu)"""
+    sizes = {}
+    for path in sorted(Path(poster_dir).glob("*")):
+        if path.suffix.lower() in IMAGE_EXTENSIONS:
+            with Image.open(path) as img:
+                sizes[path.name] = img.size
+    return sizes
+
+
+def project_points(H_inv: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """Points (N, 2) de la frame undistordue -> pixels de l'affiche, en un seul appel OpenCV"""
+    src = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+    return cv2.perspectiveTransform(src, H_inv).reshape(-1, 2)
+
+
+def segment_indices(ts: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Indices des échantillons de ts (trié) dans [starts[k], ends[k]] pour chaque k, concaténés,
+    et nombre d'échantillons par segment (sans boucle Python)
+    """
+    lo = np.searchsorted(ts, starts, side="left")
+    hi = np.searchsorted(ts, ends, side="right")
+    counts = np.maximum(hi - lo, 0)
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    idx = np.arange(counts.sum()) - np.repeat(offsets - lo, counts)
+    return idx.astype(np.int64), counts
+
+
+def project_detections(detections: PosterDetections, fixations: Dict[str, np.ndarray],
+                       gaze: Optional[Dict[str, np.ndarray]], K: np.ndarray, D: np.ndarray,
+                       sizes: Dict[str, Tuple[int, int]], source: str = "gaze") -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Points de regard de chaque détection exprimés dans le repère de son affiche.
+    fixations : load_fixations_arrays (indexé par fixation_id) ; gaze : {"ts", "x", "y"} trié par ts.
+    source="gaze" : échantillons de regard pendant la fixation, "fixation" : centre de la fixation.
+    Les points sont undistordus en un seul appel, puis un appel cv2.perspectiveTransform par détection.
+    Renvoie {nom de l'affiche: (x, y)} en convention Plotly (y vers le haut, comme heat_map_density),
+    points hors de l'affiche compris (écartés ensuite par traitement_points).
+    """
+    if source not in SOURCES:
+        raise ValueError(f"Source inconnue : {source} (disponibles : {', '.join(SOURCES)})")
+    if len(detections) == 0:
+        return {}
+
+    fix_ids = detections["fixation_id"]
+    if source == "gaze":
+        idx, counts = segment_indices(gaze["ts"], fixations["start"][fix_ids], fixations["end"][fix_ids])
+        points = np.stack([gaze["x"][idx], gaze["y"][idx]], axis=1)
+    else:
+        counts = np.ones(len(fix_ids), dtype=np.int64)
+        points = np.stack([fixations["x"][fix_ids], fixations["y"][fix_ids]], axis=1)
+    if len(points) == 0:
+        return {}
+
+    points = undistort_points(points, K, D)
+    H_inv = np.linalg.inv(detections.homographies())
+    bounds = np.concatenate(([0], np.cumsum(counts)))
+    names = detections.labels("poster_name")
+
+    projected: Dict[str, List[np.ndarray]] = {}
+    for k in np.flatnonzero(counts):
+        poster_xy = project_points(H_inv[k], points[bounds[k]:bounds[k + 1]])
+        projected.setdefault(names[k], []).append(poster_xy)
+
+    result = {}
+    for name, parts in projected.items():
+        xy = np.concatenate(parts)
+        H = sizes[name][1]
+        result[name] = (xy[:, 0], H - xy[:, 1])
+    return result
+
+
+def project_sujet(db_path: str, data_folder: str, detections: PosterDetections,
+                  sizes: Dict[str, Tuple[int, int]], source: str = "gaze",
+                  gaze_table: str = "gaze", fix_table: str = "fixations") -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    """project_detections pour un sujet : fixations, regard et calibration lus depuis sa DB et son dossier"""
+    K, D = load_camera_calibration(f"{data_folder}/scene_camera.json")
+    fixations = load_fixations_arrays(db_path, fix_table)
+    gaze = load_gaze_arrays(db_path, gaze_table) if source == "gaze" else None
+    return project_detections(detections, fixations, gaze, K, D, sizes, source)
@@ -1,26 +1,138 @@
 import cv2
+import os
 import time
+import threading
 import numpy as np
-from appelsDB import load_from_db, DB_PATH, FIX_START_COL, FIX_END_COL, FIX_X_COL, FIX_Y_COL, WORLD_TS_COL, WORLD_TS
-from undistort import undistort_frame, load_camera_calibration, undistort_points
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from appelsDB import load_fixations_arrays, DB_PATH, WORLD_TS
+from frame_index import load_alignment
+from undistort import load_camera_calibration, Undistorter
+from profiling import PROFILER
+from match_images import create_detector, BACKEND_CROP_SIZES
+from structures import keypoints_to_array
 
-def SIFT_on_fixations(
+
+def sample_frames(cap, targets):
+    """
+    Parcourt la vidéo une seule fois (sans cap.set) et renvoie les frames demandées.
+    targets : liste de (payload, frame_idx), payload étant par exemple la fixation.
+    Les frames inutiles sont sautées avec grab() (pas de décodage complet).
+    Produit des paires (payload, frame) dans l'ordre croissant de frame_idx.
+    """
+    ordered = sorted(targets, key=lambda t: t[1])
+    pos = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    frame = None
+    frame_pos = -1
+
+    for payload, frame_idx in ordered:
+        if frame_idx == frame_pos:
+            # Plusieurs fixations sur la même frame : pas de nouveau décodage
+            yield payload, frame
+            continue
+        if frame_idx < pos:
+            # Frame négative ou déjà dépassée
+            continue
+
+        with PROFILER.stage("seek"):
+            skipped = frame_idx - pos
+            while pos < frame_idx:
+                if not cap.grab():
+                    return
+                pos += 1
+        PROFILER.count("frames_skipped", skipped)
+
+        with PROFILER.stage("decode"):
+            ret, frame = cap.read()
+        if not ret or frame is None:
+            return
+        PROFILER.count("frames_decoded")
+        frame_pos = pos
+        pos += 1
+        yield payload, frame
+
+
+_thread_local = threading.local()
+
+def _thread_detector(backend="sift"):
+    """Détecteur propre au thread courant (créé une seule fois par thread et par backend)"""
+    if not hasattr(_thread_local, "detectors"):
+        _thread_local.detectors = {}
+    if backend not in _thread_local.detectors:
+        _thread_local.detectors[backend] = create_detector(backend)
+    return _thread_local.detectors[backend]
+
+
+def _detect_and_compute(crop, backend="sift"):
+    with PROFILER.stage("sift"):
+        kp, des = _thread_detector(backend).detectAndCompute(crop, None)
+    # Keypoints empaquetés dans le thread : les entrées restent picklables
+    return keypoints_to_array(kp), des
+
+
+def extract_features(items, n_threads=None, max_pending=32, backend="sift", timed=False):
+    """
+    Applique SIFT (ou le backend demandé) sur des crops dans un pool de threads
+    (OpenCV relâche le GIL).
+    items : itérable de (payload, crop), consommé au fur et à mesure.
+    max_pending : nombre max de crops en attente, pour borner la mémoire.
+    Produit des (payload, keypoints, descriptors) dans l'ordre de items,
+    keypoints étant un tableau float32 (N, 6) (voir structures.keypoints_to_array).
+    timed : ajoute à chaque sortie la durée (s) entre la soumission du crop et sa sortie
+    (attente dans la file comprise).
+    """
+    n_threads = n_threads or os.cpu_count() or 1
+    pending = deque()
+
+    def done():
+        done_payload, future, t_submit = pending.popleft()
+        result = (done_payload, *future.result())
+        return result + (time.perf_counter() - t_submit,) if timed else result
+
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        for payload, crop in items:
+            if len(pending) >= max_pending:
+                yield done()
+            pending.append((payload, pool.submit(_detect_and_compute, crop, backend), time.perf_counter()))
+
+        while pending:
+            yield done()
+
+
+def iter_fixation_features(
     data_folder: str,
     db_path: str = DB_PATH,
     video_filename: str = "e0b2c246_0.0-138.011.mp4",
     table: str = "fixations",
     world_table: str = WORLD_TS,
-    crop_size: int = 100,
+    crop_size: int = None,
+    n_threads: int = None,
+    max_pending: int = 32,
+    backend: str = "sift",
+    start_after: int = -1,
+    verbose: bool = True,
 ):
     """
     Pour chaque fixation dans la base de données, extraire un crop autour du point de fixation
     dans la vidéo undistordue, puis appliquer SIFT pour détecter des keypoints et des descripteurs.
-    Retourne une liste de dictionnaires contenant les résultats pour chaque fixation.
+    Générateur : produit un dictionnaire par fixation avec keypoints, au fur et à mesure
+    (dans l'ordre du temps), sans garder les descripteurs en mémoire.
+    Le décodage se fait dans le thread courant, SIFT dans un pool de n_threads threads
+    avec au plus max_pending crops en attente.
+    backend : "sift" (défaut), ou "orb" / "akaze" pour un passage rapide.
+    crop_size : côté du crop (px), par défaut celui du backend (BACKEND_CROP_SIZES).
+    start_after : ignore les fixations d'indice <= start_after (reprise après interruption).
+    verbose : affiche le nombre de keypoints de chaque fixation.
+    Profilage : en plus des étapes, PROFILER reçoit la latence "fixation" de chaque fixation :
+    lecture de sa propre frame, crop et undistortion, puis de la soumission à SIFT jusqu'à sa sortie
+    (hors lecture des autres fixations en vol et hors traitement de l'appelant).
     """
-    # Charger les fixations et timestamp de référence
-    fixations = load_from_db(db_path, [FIX_START_COL, FIX_END_COL, FIX_X_COL, FIX_Y_COL], table)
-    world_timestamps = load_from_db(db_path, [WORLD_TS_COL], world_table)
-    reference_timestamp = float(world_timestamps[0][0])
+    if crop_size is None:
+        crop_size = BACKEND_CROP_SIZES[backend]
+
+    # Charger les fixations et l'index fixation -> frame (timestamps réels des frames)
+    fixations = load_fixations_arrays(db_path, table)
+    alignment = load_alignment(db_path, fix_table=table, world_table=world_table)
 
     # Charger la calibration
     camera_file = f"{data_folder}/scene_camera.json"
@@ -31,60 +143,84 @@ def SIFT_on_fixations(
     cap = cv2.VideoCapture(video_path)
     if not cap.isOpened():
         raise RuntimeError(f"Impossible d'ouvrir la vidéo : {video_path}")
-    fps = cap.get(cv2.CAP_PROP_FPS)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    # Maps d'undistortion calculées une seule fois pour la vidéo
+    undistorter = Undistorter(K, D, (width, height))
 
-    results = []
-    for i, fixation in enumerate(fixations):
+    # Frame du milieu de chaque fixation (-1 avant la première frame : ignorée)
+    mid_ts = (fixations["start"] + fixations["end"]) // 2
+    mid_frame_nums = alignment["fix_mid_frame"]
+    targets = [((i, int(mid_frame_nums[i])), int(mid_frame_nums[i])) for i in range(start_after + 1, len(mid_ts))]
 
-        start_ts = float(fixation[0]) - reference_timestamp
-        end_ts = float(fixation[1]) - reference_timestamp
-        fix_x = float(fixation[2])
-        fix_y = float(fixation[3])
+    def crops():
+        frames = sample_frames(cap, targets)
+        while True:
+            t_start = time.perf_counter()  # début de la lecture de la frame de la fixation
+            item = next(frames, None)
+            if item is None:
+                return
+            (i, mid_frame_num), frame = item
 
-        mid_ts = (start_ts + end_ts) / 2.0
-        mid_frame_num = int((mid_ts / 1e9) * fps)
+            # Fenêtre du crop autour du point undistordu (coordonnées sur l'image undistorted)
+            with PROFILER.stage("crop"):
+                und_pt = undistorter.points([(float(fixations["x"][i]), float(fixations["y"][i]))])[0]
+                x0, y0, x1, y1 = undistorter.crop_bounds(int(und_pt[0]), int(und_pt[1]), crop_size)
 
-        cap.set(cv2.CAP_PROP_POS_FRAMES, mid_frame_num)
-        ret, frame = cap.read()
-        if not ret or frame is None:
-            continue
+            # Undistortion de la seule ROI, pas de la frame entière
+            with PROFILER.stage("undistort"):
+                crop = undistorter.roi(frame, x0, y0, x1, y1)
+            if crop is None:
+                # Point undistordu hors de la frame : rien à extraire
+                PROFILER.record_latency("fixation", time.perf_counter() - t_start)
+                continue
+            # Temps propre à cette fixation avant la soumission à SIFT
+            yield (i, mid_frame_num, (x0, y0), time.perf_counter() - t_start), crop
+
+    # Appliquer SIFT sur les crops avec OpenCV, en parallèle
+    try:
+        for done, ((i, mid_frame_num, crop_origin, prep), keypoints, descriptors, in_pool) in enumerate(
+                extract_features(crops(), n_threads, max_pending, backend, timed=True), start=1):
+            PROFILER.record_latency("fixation", prep + in_pool)
+            fix_x = float(fixations["x"][i])
+            fix_y = float(fixations["y"][i])
+            PROFILER.count("fixations")
+            PROFILER.count("keypoints", len(keypoints))
+            PROFILER.progress(done, len(targets))
+            if verbose:
+                print(f"Fixation {i}: {len(keypoints)} keypoints détectés.")
+
+            if len(keypoints) == 0:
+                # Ignore this fixation if no keypoints found
+                # cv2.rectangle(und_frame, (x0, y0), (x1, y1), (0, 255, 0), 2)
+                # cv2.circle(und_frame, (cx, cy), 10, (0, 0, 255), 2)
+                # cv2.imshow("Undistorted Frame", und_frame)
+                # cv2.waitKey(0)
+                pass
+            else:
+                entry = {
+                    "fix_index": i,
+                    "frame_num": mid_frame_num,
+                    "timestamp": int(mid_ts[i]),
+                    "x": fix_x,
+                    "y": fix_y,
+                    "crop_origin": crop_origin,
+                    "keypoints": keypoints,
+                    "descriptors": descriptors,
+                }
 
-        # Undistort frame et point
-        und_frame = undistort_frame(frame, K, D)
-        und_pt = undistort_points([(fix_x, fix_y)], K, D)[0]
-
-        # Extraire un crop autour du point (coordonnées sur l'image undistorted)
-        cx, cy = int(und_pt[0]), int(und_pt[1])
-        half = crop_size // 2
-        h, w = und_frame.shape[:2]
-        x0 = max(0, cx - half); x1 = min(w, cx + half)
-        y0 = max(0, cy - half); y1 = min(h, cy + half)
-        crop = und_frame[y0:y1, x0:x1].copy()
-
-        # Appliquer SIFT sur crop avec OpenCV
-        sift = cv2.SIFT_create()
-        keypoints, descriptors = sift.detectAndCompute(crop, None)
-        print(f"Fixation {i}: {len(keypoints)} keypoints détectés.")
-
-        if len(keypoints) == 0:
-            # Ignore this fixation if no keypoints found
-            # cv2.rectangle(und_frame, (x0, y0), (x1, y1), (0, 255, 0), 2)
-            # cv2.circle(und_frame, (cx, cy), 10, (0, 0, 255), 2)
-            # cv2.imshow("Undistorted Frame", und_frame)
-            # cv2.waitKey(0)
-            pass
-        else:
-            entry = {
-                "fix_index": i,
-                "frame_num": mid_frame_num,
-                "keypoints": keypoints,
-                "descriptors": descriptors,
-            }
-        
-            results.append(entry)
-
-    cap.release()
-    return results
+                yield entry
+    finally:
+        cap.release()
+
+
+def SIFT_on_fixations(data_folder: str, db_path: str = DB_PATH, video_filename: str = "e0b2c246_0.0-138.011.mp4",
+                      **kwargs):
+    """
+    Comme iter_fixation_features, mais retourne la liste des dictionnaires
+    de toutes les fixations (tout est gardé en mémoire).
+    """
+    return list(iter_fixation_features(data_folder, db_path, video_filename, **kwargs))
 
 if __name__ == "__main__":
     # Exécution d'exemple, limiter à 10 fixations pour test rapide
@@ -1,39 +1,252 @@
-
 import cv2
+import os
+import json
+import shutil
+import tempfile
+import hashlib
 import numpy as np
 import pandas as pd
 from pathlib import Path
 from dataclasses import dataclass, asdict
 from typing import List, Dict, Any, Optional
-from structures import PosterRef
+from structures import PosterRef, keypoints_to_array
 
+# Dossier des affiches et formats d'image reconnus (partagés par les autres modules)
+POSTERS_DIR = "data/Affiches"
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".bmp"]
+
+# Cache des features des posters (keypoints + descripteurs)
+CACHE_DIR = "cache/posters"
+CACHE_VERSION = 2  # à incrémenter si le format du cache change
+
+# Référence des posters : pyramide limitée à la taille à laquelle un poster apparaît
+# dans la caméra de scène (1600x1200), et budget de keypoints répartis sur une grille
+REF_MAX_SIDE = 1200       # plus grand côté du premier niveau (None = pleine résolution)
+REF_LEVELS = 1            # niveaux de la pyramide (facteur 2 entre niveaux). SIFT et ORB ont déjà
+                          # leur propre pyramide : des niveaux en plus dupliquent les features
+                          # et font échouer le ratio test
+KEYPOINT_BUDGET = 4000    # keypoints max par poster (None = pas de limite)
+GRID_CELLS = 8            # grille GRID_CELLS x GRID_CELLS pour la sélection uniforme
+
+
+def backend_name(detector) -> str:
+    """Nom court du détecteur : "sift", "orb", "akaze"..."""
+    return detector.getDefaultName().split(".")[-1].lower()
+
+
+def detector_params(detector) -> Dict[str, Any]:
+    """Paramètres du détecteur qui influencent les features (pour la clé du cache)."""
+    backend = backend_name(detector)
+    if backend == "sift":
+        params = {
+            "nfeatures": detector.getNFeatures(),
+            "nOctaveLayers": detector.getNOctaveLayers(),
+            "contrastThreshold": detector.getContrastThreshold(),
+            "edgeThreshold": detector.getEdgeThreshold(),
+            "sigma": detector.getSigma(),
+        }
+    elif backend == "orb":
+        params = {
+            "nfeatures": detector.getMaxFeatures(),
+            "scaleFactor": detector.getScaleFactor(),
+            "nlevels": detector.getNLevels(),
+            "edgeThreshold": detector.getEdgeThreshold(),
+            "fastThreshold": detector.getFastThreshold(),
+            "patchSize": detector.getPatchSize(),
+            "WTA_K": detector.getWTA_K(),
+            "scoreType": int(detector.getScoreType()),
+        }
+    elif backend == "akaze":
+        params = {
+            "threshold": detector.getThreshold(),
+            "nOctaves": detector.getNOctaves(),
+            "nOctaveLayers": detector.getNOctaveLayers(),
+            "descriptorType": int(detector.getDescriptorType()),
+            "descriptorSize": detector.getDescriptorSize(),
+            "descriptorChannels": detector.getDescriptorChannels(),
+            "diffusivity": int(detector.getDiffusivity()),
+        }
+    else:
+        raise ValueError(f"Détecteur non supporté pour le cache : {backend}")
+    return {"backend": backend, **params}
 
-def load_posters(poster_dir: str, sift: cv2.SIFT) -> List[PosterRef]:
-    poster_dir = Path(poster_dir)
-    posters: List[PosterRef] = []
 
-    for img_path in poster_dir.glob("*"):
-        if not img_path.suffix.lower() in [".jpg", ".jpeg", ".png", ".bmp"]:
+def cache_key(img_bytes: bytes, params: Dict[str, Any]) -> str:
+    """Clé du cache : hash du contenu de l'image + paramètres SIFT + version du cache."""
+    h = hashlib.sha1(img_bytes)
+    h.update(json.dumps(params, sort_keys=True).encode())
+    h.update(f"v{CACHE_VERSION}".encode())
+    return h.hexdigest()[:16]
+
+
+def select_uniform(kp_arr: np.ndarray, budget: int, size: tuple, grid: int = GRID_CELLS) -> np.ndarray:
+    """
+    Indices d'au plus `budget` keypoints répartis uniformément sur une grille :
+    on prend le meilleur keypoint (response) de chaque case, puis le deuxième, etc.
+    kp_arr : tableau de keypoints_to_array, size : (w, h) de l'image.
+    """
+    n = len(kp_arr)
+    if budget is None or n <= budget:
+        return np.arange(n)
+
+    w, h = size
+    cx = np.clip((kp_arr[:, 0] * grid / w).astype(np.int64), 0, grid - 1)
+    cy = np.clip((kp_arr[:, 1] * grid / h).astype(np.int64), 0, grid - 1)
+    cell = cy * grid + cx
+    response = kp_arr[:, 4]
+
+    # Rang de chaque keypoint dans sa case (0 = meilleure response)
+    order = np.lexsort((-response, cell))
+    sorted_cells = cell[order]
+    group_start = np.flatnonzero(np.r_[True, sorted_cells[1:] != sorted_cells[:-1]])
+    group_sizes = np.diff(np.r_[group_start, n])
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n) - np.repeat(group_start, group_sizes)
+
+    return np.lexsort((-response, rank))[:budget]
+
+
+def build_reference_features(gray: np.ndarray, detector, max_side: Optional[int] = REF_MAX_SIDE,
+                             levels: int = REF_LEVELS, budget: Optional[int] = KEYPOINT_BUDGET):
+    """
+    Keypoints et descripteurs d'un poster calculés sur une pyramide de résolutions
+    (premier niveau limité à max_side), avec au plus `budget` keypoints répartis
+    uniformément. Les coordonnées des keypoints restent en pleine résolution.
+    Renvoie (tableau de keypoints_to_array, descripteurs) ou (None, None).
+    """
+    h, w = gray.shape
+    scale = 1.0 if max_side is None else min(1.0, max_side / max(h, w))
+    img = gray if scale >= 1.0 else cv2.resize(gray, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA)
+
+    kp_arrays, des_list = [], []
+    for level in range(levels):
+        if level > 0:
+            img = cv2.pyrDown(img)
+        kp, des = detector.detectAndCompute(img, None)
+        if des is None or len(kp) == 0:
             continue
+        # Retour aux coordonnées pleine résolution
+        sx, sy = w / img.shape[1], h / img.shape[0]
+        arr = keypoints_to_array(kp)
+        arr[:, 0] *= sx
+        arr[:, 1] *= sy
+        arr[:, 2] *= (sx + sy) / 2
+        kp_arrays.append(arr)
+        des_list.append(des)
 
-        img = cv2.imread(str(img_path), cv2.IMREAD_COLOR)
-        if img is None:
-            print(f"Impossible de lire {img_path}")
+    if not kp_arrays:
+        return None, None
+
+    kp_arr = np.vstack(kp_arrays)
+    des = np.vstack(des_list)
+    keep = select_uniform(kp_arr, budget, (w, h))
+    return kp_arr[keep], des[keep]
+
+
+def _save_npy(path: Path, arr: np.ndarray):
+    with open(path, "wb") as f:
+        np.save(f, arr)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def write_cache_entry(entry: Path, kp_arr: np.ndarray, des: np.ndarray, meta: Dict[str, Any]):
+    """
+    Écrit une entrée du cache de façon atomique : tout est écrit (et fsync) dans un dossier
+    temporaire voisin, meta.json en dernier, puis le dossier est renommé en entry.
+    Une entrée publiée n'est jamais réécrite : si un autre processus l'a créée entre-temps,
+    on garde la sienne (même contenu) et on jette la nôtre.
+    """
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(prefix=f".{entry.name}-", dir=entry.parent))
+    try:
+        _save_npy(tmp / "kp.npy", kp_arr)
+        _save_npy(tmp / "des.npy", des)
+        with open(tmp / "meta.json", "w") as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        if entry.exists() and not (entry / "meta.json").exists():
+            shutil.rmtree(entry, ignore_errors=True)  # entrée incomplète d'une ancienne version
+        try:
+            os.replace(tmp, entry)
+        except OSError:
+            if not (entry / "meta.json").exists():
+                raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def load_poster_features(img_path: Path, detector, cache_dir: Optional[str] = CACHE_DIR,
+                         max_side: Optional[int] = REF_MAX_SIDE, levels: int = REF_LEVELS,
+                         budget: Optional[int] = KEYPOINT_BUDGET) -> Optional[PosterRef]:
+    """
+    Calcule (ou relit depuis le cache) les keypoints et descripteurs d'un poster
+    (SIFT, ORB ou AKAZE selon le détecteur), voir build_reference_features.
+    Les descripteurs sont stockés en .npy et relus en memory-map.
+    cache_dir=None désactive le cache.
+    """
+    img_path = Path(img_path)
+    img_bytes = img_path.read_bytes()
+
+    entry = None
+    if cache_dir is not None:
+        params = {**detector_params(detector), "max_side": max_side, "levels": levels, "budget": budget}
+        entry = Path(cache_dir) / f"{img_path.stem}-{cache_key(img_bytes, params)}"
+        meta_path = entry / "meta.json"
+        if meta_path.exists():
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            kp_arr = np.load(entry / "kp.npy")
+            des = np.load(entry / "des.npy", mmap_mode="r")
+            return PosterRef(
+                name=img_path.name,
+                kp=kp_arr,
+                des=des,
+                size=tuple(meta["size"]),
+                backend=meta.get("backend", "sift"),
+            )
+
+    img = cv2.imdecode(np.frombuffer(img_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        print(f"Impossible de lire {img_path}")
+        return None
+
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    kp_arr, des = build_reference_features(gray, detector, max_side, levels, budget)
+    if des is None:
+        print(f"Pas de features {backend_name(detector)} pour {img_path.name}")
+        return None
+
+    h, w = gray.shape
+    if entry is not None:
+        write_cache_entry(entry, kp_arr, des, {"name": img_path.name, "size": [w, h],
+                                               "backend": backend_name(detector), "version": CACHE_VERSION})
+
+    return PosterRef(
+        name=img_path.name,
+        kp=kp_arr,
+        des=des,
+        size=(w, h),
+        backend=backend_name(detector),
+    )
+
+
+def load_posters(poster_dir: str, detector, cache_dir: Optional[str] = CACHE_DIR,
+                 max_side: Optional[int] = REF_MAX_SIDE, levels: int = REF_LEVELS,
+                 budget: Optional[int] = KEYPOINT_BUDGET) -> List[PosterRef]:
+    poster_dir = Path(poster_dir)
+    posters: List[PosterRef] = []
+
+    for img_path in sorted(poster_dir.glob("*")):
+        if not img_path.suffix.lower() in IMAGE_EXTENSIONS:
             continue
 
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        kp, des = sift.detectAndCompute(gray, None)
-        if des is None or len(kp) == 0:
-            print(f"Pas de features SIFT pour {img_path.name}")
+        poster = load_poster_features(img_path, detector, cache_dir, max_side, levels, budget)
+        if poster is None:
             continue
 
-        h, w = gray.shape
-        posters.append(PosterRef(
-            name=img_path.name,
-            kp=kp,
-            des=des,
-            size=(w, h),
-        ))
-        print(f"Poster chargé : {img_path.name} ({len(kp)} keypoints)")
+        posters.append(poster)
+        print(f"Poster chargé : {img_path.name} ({len(poster.kp)} keypoints)")
 
-    return posters
\ No newline at end of file
+    return posters
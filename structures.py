@@ -1,23 +1,50 @@
 import cv2
+import json
+import hashlib
 import numpy as np
 import pandas as pd
-from pathlib import Path
-from dataclasses import dataclass, asdict
-from typing import List, Dict, Any, Optional
+from dataclasses import dataclass, fields
+from typing import Dict, Any, Optional
+
+# Keypoints empaquetés en float32 : une ligne (x, y, size, angle, response, octave) par keypoint.
+# Contrairement aux listes de cv2.KeyPoint, ces tableaux se picklent (et se mettent en cache) sans coût.
+KEYPOINT_FIELDS = ("x", "y", "size", "angle", "response", "octave")
+
+# Homographie affiche -> frame undistordue d'une détection, stockée coefficient par coefficient
+HOMOGRAPHY_FIELDS = tuple(f"h{i}{j}" for i in range(3) for j in range(3))
+
+
+def keypoints_to_array(kp) -> np.ndarray:
+    """Convertit une liste de cv2.KeyPoint en tableau float32 (N, 6) (x, y, size, angle, response, octave)."""
+    if isinstance(kp, np.ndarray):
+        return kp
+    return np.array(
+        [(k.pt[0], k.pt[1], k.size, k.angle, k.response, k.octave) for k in kp], dtype=np.float32
+    ).reshape(-1, len(KEYPOINT_FIELDS))
+
+
+def array_to_keypoints(arr: np.ndarray):
+    """Reconstruit la liste de cv2.KeyPoint (pour l'affichage) à partir du tableau de keypoints_to_array."""
+    return [
+        cv2.KeyPoint(float(x), float(y), float(s), float(a), float(r), int(o))
+        for x, y, s, a, r, o in np.asarray(arr).tolist()
+    ]
+
 
 @dataclass
 class PosterRef:
     name: str
-    kp: Any
+    kp: np.ndarray  # keypoints empaquetés (N, 6), voir keypoints_to_array
     des: np.ndarray
     size: tuple  # (w, h)
+    backend: str = "sift"  # détecteur qui a produit kp/des
 
 
 @dataclass
 class Fixation:
     fixation_id: int
-    start: float
-    end: float
+    start: int  # ns
+    end: int    # ns
     x: float
     y: float
 
@@ -34,11 +61,180 @@ class FixationFrameCandidate:
 class PosterDetection:
     fixation_id: int
     frame_idx: int
-    timestamp: float
+    timestamp: int  # ns
     poster_name: str
     inliers: int
     total_matches: int
     inlier_ratio: float
     x: float
     y: float
-  
\ No newline at end of file
+    backend: str = "sift"
+    # Homographie (px de l'affiche -> px de la frame undistordue), voir homography_fields
+    h00: float = float("nan")
+    h01: float = float("nan")
+    h02: float = float("nan")
+    h10: float = float("nan")
+    h11: float = float("nan")
+    h12: float = float("nan")
+    h20: float = float("nan")
+    h21: float = float("nan")
+    h22: float = float("nan")
+
+
+def homography_fields(H) -> Dict[str, float]:
+    """Champs h00..h22 d'une PosterDetection à partir d'une matrice 3x3"""
+    return dict(zip(HOMOGRAPHY_FIELDS, np.asarray(H, dtype=np.float64).ravel().tolist()))
+
+
+class RecordArray:
+    """
+    Conteneur « structure de tableaux » adossé à un tableau structuré NumPy
+    (une ligne par élément, une colonne par champ de row_type).
+    - arr["x"] : colonne (vue, sans copie)
+    - arr[i] : une ligne, sous forme de row_type (dataclass)
+    - arr[a:b] : sous-ensemble (vue, sans copie) ; arr[masque] ou arr[indices] : copie
+    Les champs texte (categorical) sont stockés en codes int16 avec une table de libellés,
+    ce qui garde le tableau compact et rapide à pickler entre processus.
+    """
+    dtype: np.dtype = None
+    row_type = None
+    categorical: tuple = ()
+
+    def __init__(self, data: Optional[np.ndarray] = None, categories: Optional[Dict[str, tuple]] = None):
+        self.data = np.zeros(0, dtype=self.dtype) if data is None else np.asarray(data, dtype=self.dtype)
+        categories = categories or {}
+        self.categories = {name: tuple(categories.get(name, ())) for name in self.categorical}
+
+    @classmethod
+    def from_rows(cls, rows) -> "RecordArray":
+        """Construit le conteneur depuis une liste de row_type (dataclasses)"""
+        rows = list(rows)
+        columns = {f.name: [getattr(r, f.name) for r in rows] for f in fields(cls.row_type)}
+        return cls.from_columns(**columns)
+
+    @classmethod
+    def from_columns(cls, **columns) -> "RecordArray":
+        """Construit le conteneur depuis des colonnes (tableaux ou listes de même longueur)"""
+        n = len(next(iter(columns.values()))) if columns else 0
+        data = np.zeros(n, dtype=cls.dtype)
+        categories = {}
+        for name, values in columns.items():
+            if name in cls.categorical:
+                labels, codes = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+                categories[name] = tuple(labels.tolist())
+                values = codes
+            data[name] = values
+        return cls(data, categories)
+
+    @classmethod
+    def concat(cls, parts) -> "RecordArray":
+        """Concatène plusieurs conteneurs, en fusionnant les tables de libellés"""
+        parts = list(parts)
+        categories = {
+            name: tuple(sorted(set().union(*(p.categories[name] for p in parts))))
+            for name in cls.categorical
+        }
+        chunks = []
+        for part in parts:
+            chunk = part.data.copy()
+            for name in cls.categorical:
+                remap = np.array([categories[name].index(l) for l in part.categories[name]], dtype=np.int16)
+                if len(remap):
+                    chunk[name] = remap[chunk[name]]
+            chunks.append(chunk)
+        data = np.concatenate(chunks) if chunks else None
+        return cls(data, categories)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        for i in range(len(self.data)):
+            yield self.row(i)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.data[key]
+        if isinstance(key, (int, np.integer)):
+            return self.row(key)
+        return type(self)(self.data[key], self.categories)
+
+    def row(self, i: int):
+        record = self.data[i]
+        values = {}
+        for name in self.dtype.names:
+            value = record[name].item()
+            values[name] = self.categories[name][value] if name in self.categorical else value
+        return self.row_type(**values)
+
+    def labels(self, name: str) -> np.ndarray:
+        """Colonne texte décodée (tableau d'objets str)"""
+        return np.array(self.categories[name], dtype=object)[self.data[name]]
+
+    def filter(self, mask) -> "RecordArray":
+        return self[np.asarray(mask, dtype=bool)]
+
+    def group_by(self, name: str) -> Dict[Any, "RecordArray"]:
+        """Sous-conteneurs par valeur du champ name (libellé pour un champ texte), ordre d'origine conservé"""
+        if len(self) == 0:
+            return {}
+        keys = self.data[name]
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        groups = {}
+        for idx in np.split(order, starts[1:]):
+            key = keys[idx[0]].item()
+            if name in self.categorical:
+                key = self.categories[name][key]
+            groups[key] = self[idx]
+        return groups
+
+    def fingerprint(self) -> str:
+        """Empreinte du contenu (lignes et libellés), pour savoir si un résultat dérivé est à jour"""
+        h = hashlib.sha1(np.ascontiguousarray(self.data).tobytes())
+        h.update(json.dumps({name: list(self.categories[name]) for name in self.categorical}).encode())
+        return h.hexdigest()
+
+    def to_dataframe(self) -> pd.DataFrame:
+        columns = {}
+        for name in self.dtype.names:
+            if name in self.categorical:
+                columns[name] = pd.Categorical.from_codes(self.data[name], categories=list(self.categories[name]))
+            else:
+                columns[name] = self.data[name]
+        return pd.DataFrame(columns)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({len(self)} lignes)"
+
+
+class Fixations(RecordArray):
+    dtype = np.dtype([
+        ("fixation_id", np.int64), ("start", np.int64), ("end", np.int64),
+        ("x", np.float32), ("y", np.float32),
+    ])
+    row_type = Fixation
+
+
+class FixationFrameCandidates(RecordArray):
+    dtype = np.dtype([
+        ("fixation_id", np.int64), ("frame_idx", np.int64),
+        ("x", np.float32), ("y", np.float32),
+    ])
+    row_type = FixationFrameCandidate
+
+
+class PosterDetections(RecordArray):
+    dtype = np.dtype([
+        ("fixation_id", np.int64), ("frame_idx", np.int64), ("timestamp", np.int64),
+        ("poster_name", np.int16), ("inliers", np.int32), ("total_matches", np.int32),
+        ("inlier_ratio", np.float32), ("x", np.float32), ("y", np.float32),
+        ("backend", np.int16),
+    ] + [(name, np.float64) for name in HOMOGRAPHY_FIELDS])
+    row_type = PosterDetection
+    categorical = ("poster_name", "backend")
+
+    def homographies(self) -> np.ndarray:
+        """Homographies des détections, tableau (N, 3, 3)"""
+        return np.stack([self.data[name] for name in HOMOGRAPHY_FIELDS], axis=1).reshape(-1, 3, 3)
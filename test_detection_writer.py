@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from detection_writer import DetectionWriter, read_detections
+from structures import PosterDetection, homography_fields
+
+FORMATS = ["csv", "sqlite"]
+
+
+def detection(fixation_id):
+    return PosterDetection(fixation_id=fixation_id, frame_idx=fixation_id * 3, timestamp=fixation_id * 10**8,
+                           poster_name=f"affiche{fixation_id % 3}.png", inliers=20, total_matches=40,
+                           inlier_ratio=0.5, x=100.0 + fixation_id, y=200.0, **homography_fields(np.eye(3)))
+
+
+def run(writer, fixation_ids):
+    # Une détection sur deux fixations, comme un sujet réel où certaines fixations ne matchent pas
+    for fixation_id in fixation_ids:
+        if fixation_id % 2 == 0:
+            writer.write(detection(fixation_id))
+        writer.mark_processed(fixation_id)
+
+
+class Crash(Exception):
+    pass
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_resume_after_crash_between_append_and_checkpoint(tmp_path, monkeypatch, fmt):
+    writer = DetectionWriter(str(tmp_path), "sujet", fmt, flush_rows=2, flush_seconds=1e9)
+    run(writer, range(0, 6))
+    assert writer.checkpoint["last_fixation_id"] == 2  # 4 encore dans le tampon
+
+    # Arrêt après l'écriture d'un lot, avant la mise à jour du checkpoint
+    def crash():
+        raise Crash()
+    monkeypatch.setattr(writer, "_save_checkpoint", crash)
+    with pytest.raises(Crash):
+        run(writer, range(6, 8))
+    assert len(read_detections(str(tmp_path), "sujet", fmt)) == 4  # lot (4, 6) écrit sans checkpoint
+
+    resumed = DetectionWriter(str(tmp_path), "sujet", fmt, flush_rows=2, flush_seconds=1e9)
+    assert resumed.last_fixation_id == 2
+    assert not resumed.done
+    with resumed:
+        run(resumed, range(resumed.last_fixation_id + 1, 12))
+        resumed.finish()
+
+    detections = resumed.read()
+    np.testing.assert_array_equal(detections["fixation_id"], np.arange(0, 12, 2))
+    assert list(detections.labels("poster_name")) == [detection(i).poster_name for i in range(0, 12, 2)]
+    np.testing.assert_allclose(detections.homographies(), np.broadcast_to(np.eye(3), (6, 3, 3)))
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_finished_subject_is_not_redone(tmp_path, fmt):
+    with DetectionWriter(str(tmp_path), "sujet", fmt) as writer:
+        run(writer, range(5))
+        writer.finish()
+    again = DetectionWriter(str(tmp_path), "sujet", fmt)
+    assert again.done
+    np.testing.assert_array_equal(again.read()["fixation_id"], [0, 2, 4])
+
+
+@pytest.mark.parametrize("fmt", FORMATS)
+def test_params_change_restarts(tmp_path, fmt):
+    with DetectionWriter(str(tmp_path), "sujet", fmt, params={"backend": "sift"}) as writer:
+        run(writer, range(4))
+    restarted = DetectionWriter(str(tmp_path), "sujet", fmt, params={"backend": "orb"})
+    assert restarted.last_fixation_id == -1
+    assert len(restarted.read()) == 0
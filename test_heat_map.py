@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+import heat_map
+from heat_map import heat_map_density
+
+
+def heat_map_density_reference(x, y, W, H, distance=200):
+    # Implémentation d'origine (une boucle par point), référence pour l'équivalence
+    z = np.zeros((H, W))
+    center = distance // 2
+    y_indices, x_indices = np.ogrid[:distance, :distance]
+    dist_from_center = np.sqrt((y_indices - center) ** 2 + (x_indices - center) ** 2)
+    mask = np.maximum(0, (center - dist_from_center) / center)
+
+    for i in range(len(x)):
+        if np.isnan(x[i]) or np.isnan(y[i]):
+            continue
+        x_pos = int(x[i])
+        y_pos = int(y[i])
+        x_start = max(0, x_pos - center)
+        x_end = min(W, x_pos + center)
+        y_start = max(0, y_pos - center)
+        y_end = min(H, y_pos + center)
+        if x_end <= x_start or y_end <= y_start:
+            continue
+        mask_x_start = max(0, center - x_pos)
+        mask_y_start = max(0, center - y_pos)
+        mask_portion = mask[mask_y_start:mask_y_start + y_end - y_start,
+                            mask_x_start:mask_x_start + x_end - x_start]
+        z[y_start:y_end, x_start:x_end] += mask_portion
+    return z
+
+
+def random_points(n, W, H, seed=0):
+    # Points dans l'image et autour (contribution partielle près des bords), avec des NaN
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(-80, W + 80, n)
+    y = rng.uniform(-80, H + 80, n)
+    x[::11] = np.nan
+    return x, y
+
+
+@pytest.mark.parametrize("n", [0, 1, 50, heat_map.DIRECT_MAX_POINTS, heat_map.DIRECT_MAX_POINTS + 1, 6000])
+@pytest.mark.parametrize("distance", [50, 51, 300])
+def test_density_matches_reference(n, distance):
+    W, H = 640, 480
+    x, y = random_points(n, W, H, seed=n + distance)
+    z = heat_map_density(x, y, W, H, distance)
+    assert z.shape == (H, W)
+    np.testing.assert_allclose(z, heat_map_density_reference(x, y, W, H, distance), rtol=0, atol=1e-9)
+
+
+def test_density_both_paths_agree(monkeypatch):
+    W, H = 500, 300
+    x, y = random_points(800, W, H, seed=3)
+    direct = heat_map_density(x, y, W, H, 120)
+    monkeypatch.setattr(heat_map, "DIRECT_MAX_POINTS", 0)
+    convolved = heat_map_density(x, y, W, H, 120)
+    np.testing.assert_allclose(convolved, direct, rtol=0, atol=1e-9)
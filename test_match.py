@@ -1,18 +1,13 @@
 import match_images
-import os 
 import cv2
+from ptsInteretPosterImages import load_posters
     
 path_posters = "./data/Affiches/"
 path_test = "./data/Affiches/Franklin.png"
      
 if __name__ == "__main__":
-    images = []
-    for filename in os.listdir(path_posters):
-        if filename.lower().endswith((".jpg", ".jpeg", ".png")):
-            img_path = os.path.join(path_posters, filename)
-            img = cv2.imread(img_path,cv2.IMREAD_GRAYSCALE)
-            if img is not None:
-                images.append(img)
+    # Features des posters relues depuis le cache si possible
+    posters = load_posters(path_posters, match_images.create_sift())
              
     image_test = cv2.imread(path_test,cv2.IMREAD_GRAYSCALE)
     h, w = image_test.shape[:2]
@@ -23,11 +18,9 @@ if __name__ == "__main__":
     cv2.waitKey(0)
     cv2.destroyAllWindows()
 
-    # for i in range(len(images)):
-    #     match_images.match_and_display(images[i],image_test)
-    sift_all_orig = [match_images.apply_sift(im) for im in images]
-    sift_test = match_images.apply_sift(image_test)
-    descriptors_all_orig = [desc for _, desc in sift_all_orig]
-    descriptors_test = sift_test[1]
-    id_best_match = match_images.match_all(descriptors_all_orig, descriptors_test, seuil=40)
+    keypoints_test, descriptors_test = match_images.apply_sift(image_test)
+    index = match_images.PosterIndex.from_posters(posters)
+    # Même vérification que le pipeline : votes puis homographie RANSAC
+    result = match_images.verify_candidates(index, keypoints_test, descriptors_test)
+    id_best_match = -1 if result is None else result[0]
     print("ID best match:", id_best_match)
\ No newline at end of file
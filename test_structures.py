@@ -0,0 +1,102 @@
+import pickle
+import numpy as np
+import pytest
+from structures import Fixations, PosterDetection, PosterDetections, homography_fields
+
+
+def detection(fixation_id, poster_name, backend="sift"):
+    # Valeurs exactes en float32 pour comparer les lignes relues avec ==
+    H = np.arange(9, dtype=np.float64).reshape(3, 3) + fixation_id
+    return PosterDetection(fixation_id=fixation_id, frame_idx=2 * fixation_id, timestamp=10**9 + fixation_id,
+                           poster_name=poster_name, inliers=10 + fixation_id, total_matches=40,
+                           inlier_ratio=0.25, x=100.5 + fixation_id, y=50.25, backend=backend,
+                           **homography_fields(H))
+
+
+def sample_rows():
+    names = ["Noether.png", "Bell.png", "Noether.png", "Anning.png", "Bell.png"]
+    return [detection(i, name, "orb" if i == 3 else "sift") for i, name in enumerate(names)]
+
+
+def test_from_columns_categorical_codes():
+    fixations = Fixations.from_columns(fixation_id=[0, 1], start=[5, 7], end=[6, 9], x=[1.5, 2.5], y=[3.0, 4.0])
+    assert fixations.categories == {}
+    np.testing.assert_array_equal(fixations["end"], [6, 9])
+
+    detections = PosterDetections.from_rows(sample_rows())
+    assert detections.categories["poster_name"] == ("Anning.png", "Bell.png", "Noether.png")
+    assert detections.categories["backend"] == ("orb", "sift")
+    assert detections["poster_name"].dtype == np.int16
+    np.testing.assert_array_equal(detections["poster_name"], [2, 1, 2, 0, 1])
+    assert list(detections.labels("poster_name")) == [r.poster_name for r in sample_rows()]
+
+
+def test_rows_round_trip():
+    rows = sample_rows()
+    detections = PosterDetections.from_rows(rows)
+    assert len(detections) == len(rows)
+    assert list(detections) == rows
+    assert detections[-1] == rows[-1]
+    np.testing.assert_array_equal(detections.homographies()[1], np.arange(9).reshape(3, 3) + 1)
+
+
+def test_dataframe_and_pickle_round_trip():
+    detections = PosterDetections.from_rows(sample_rows())
+    df = detections.to_dataframe()
+    assert list(df.columns) == list(PosterDetection.__dataclass_fields__)
+    assert list(df["poster_name"].astype(str)) == [r.poster_name for r in sample_rows()]
+
+    again = PosterDetections.from_columns(**{col: df[col].to_numpy() for col in df.columns})
+    assert list(again) == list(detections)
+    assert again.fingerprint() == detections.fingerprint()
+
+    unpickled = pickle.loads(pickle.dumps(detections))
+    assert list(unpickled) == list(detections)
+
+
+def test_slices_and_masks():
+    detections = PosterDetections.from_rows(sample_rows())
+    head = detections[1:3]
+    assert np.shares_memory(head.data, detections.data)
+    assert [d.fixation_id for d in head] == [1, 2]
+
+    kept = detections.filter(detections["inliers"] >= 12)
+    assert not np.shares_memory(kept.data, detections.data)
+    assert list(kept.labels("poster_name")) == ["Noether.png", "Anning.png", "Bell.png"]
+
+
+def test_group_by_keeps_original_order():
+    detections = PosterDetections.from_rows(sample_rows())
+    groups = detections.group_by("poster_name")
+    assert set(groups) == {"Anning.png", "Bell.png", "Noether.png"}
+    np.testing.assert_array_equal(groups["Noether.png"]["fixation_id"], [0, 2])
+    np.testing.assert_array_equal(groups["Bell.png"]["fixation_id"], [1, 4])
+    assert all(set(g.labels("poster_name")) == {name} for name, g in groups.items())
+
+    by_matches = detections.group_by("total_matches")
+    assert list(by_matches) == [40] and len(by_matches[40]) == len(detections)
+    assert PosterDetections().group_by("poster_name") == {}
+
+
+def test_fingerprint():
+    detections = PosterDetections.from_rows(sample_rows())
+    assert detections.fingerprint() == PosterDetections.from_rows(sample_rows()).fingerprint()
+
+    changed = PosterDetections.from_rows(sample_rows())
+    changed["inliers"][0] += 1
+    assert changed.fingerprint() != detections.fingerprint()
+
+    # Mêmes codes, autres libellés
+    renamed = PosterDetections(detections.data.copy(), {**detections.categories,
+                                                        "poster_name": ("A.png", "B.png", "C.png")})
+    assert renamed.fingerprint() != detections.fingerprint()
+
+
+@pytest.mark.parametrize("split", [0, 2, 5])
+def test_concat_merges_labels(split):
+    rows = sample_rows()
+    parts = [PosterDetections.from_rows(rows[:split]), PosterDetections.from_rows(rows[split:])]
+    merged = PosterDetections.concat(parts)
+    assert list(merged) == rows
+    assert merged.categories["poster_name"] == ("Anning.png", "Bell.png", "Noether.png")
+    assert merged.fingerprint() == PosterDetections.from_rows(rows).fingerprint()
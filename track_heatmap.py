@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
-import sqlite3
 import cv2
 import numpy as np
+from functools import partial
+from video_pipeline import process_video
+from appelsDB import load_gaze_arrays
+from frame_index import load_alignment
 
 # Adjustable parameters -------------------------
 
@@ -29,33 +32,13 @@ How strong the heatmap overlay appears on the video.
 0.3 = subtle overlay
 """
 
-# ------------------------------------------------
-
-
-def load_gaze_from_sqlite(db_path, table="gaze"):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-
-    cursor.execute(f"""
-        SELECT
-            "timestamp [ns]" AS ts,
-            "gaze x [px]" AS x,
-            "gaze y [px]" AS y
-        FROM {table}
-        ORDER BY ts ASC;
-    """)
-
-    rows = cursor.fetchall()
-    conn.close()
-
-    if not rows:
-        raise RuntimeError("No gaze samples found in DB.")
-
-    timestamps = np.array([r[0] for r in rows], dtype=np.int64)
-    xs = np.array([r[1] for r in rows], dtype=float)
-    ys = np.array([r[2] for r in rows], dtype=float)
+WARMUP_LEVEL = 1.0 / 255
+"""
+In segment-parallel mode, each segment starts early enough for heat older
+than the warm-up to have faded below this fraction (invisible once rendered).
+"""
 
-    return timestamps, xs, ys
+# ------------------------------------------------
 
 
 def make_gaussian_kernel(size, intensity=1.0):
@@ -67,84 +50,158 @@ def make_gaussian_kernel(size, intensity=1.0):
     return kernel
 
 
-def annotate_video(input_video, output_video, db_path):
-    print(f"Loading gaze data from {db_path} ...")
-    gaze_ts, xs, ys = load_gaze_from_sqlite(db_path)
-    min_gaze_ts = np.min(gaze_ts)
-    gaze_ts = gaze_ts - min_gaze_ts
-
-    cap = cv2.VideoCapture(input_video)
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    dt_ns = 1e9 / fps
-
-    width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+class DecayingHeatmap:
+    """
+    Progressive heatmap with lazy decay.
+
+    The displayed heatmap is scale * raw: fading only multiplies `scale`,
+    and new gaze kernels are added to `raw` divided by `scale`. Since the
+    overlay is normalized by the maximum, scale cancels out and the red
+    channel only changes where kernels were added, unless the running
+    maximum grows. Output buffers are allocated once.
+    """
+
+    RENORM_THRESHOLD = 1e-6
+    """Fold `scale` back into `raw` below this value to stay in float32 range."""
+
+    def __init__(self, width, height, kernel, fade=FADE_FACTOR, alpha=ALPHA):
+        self.width = width
+        self.height = height
+        self.kernel = kernel.astype(np.float32)
+        self.radius = kernel.shape[0] // 2
+        self.fade = fade
+        self.alpha = alpha
+
+        self.raw = np.zeros((height, width), dtype=np.float32)
+        self.scale = 1.0
+        self.max_raw = 0.0
+
+        self.heat_color = np.zeros((height, width, 3), dtype=np.uint8)
+        self.overlay = np.empty((height, width, 3), dtype=np.uint8)
+        self._norm = np.empty((height, width), dtype=np.float32)
+
+        self._dirty = None  # (x1, y1, x2, y2) region to redraw
+        self._redraw_all = False
+
+    def decay(self):
+        self.scale *= self.fade
+        if self.scale < self.RENORM_THRESHOLD:
+            self.raw *= self.scale
+            self.max_raw *= self.scale
+            self.scale = 1.0
+
+    def add(self, gx, gy):
+        """Add the kernel centered at (gx, gy), clipped to the frame."""
+        r = self.radius
+        x1 = max(gx - r, 0)
+        x2 = min(gx + r, self.width)
+        y1 = max(gy - r, 0)
+        y2 = min(gy + r, self.height)
+        if x2 <= x1 or y2 <= y1:
+            return
+
+        kx1 = r - (gx - x1)
+        ky1 = r - (gy - y1)
+        kx2 = kx1 + (x2 - x1)
+        ky2 = ky1 + (y2 - y1)
+
+        region = self.raw[y1:y2, x1:x2]
+        region += self.kernel[ky1:ky2, kx1:kx2] * np.float32(1.0 / self.scale)
+
+        region_max = float(region.max())
+        if region_max > self.max_raw:
+            self.max_raw = region_max
+            self._redraw_all = True
+        elif self._dirty is None:
+            self._dirty = (x1, y1, x2, y2)
+        else:
+            dx1, dy1, dx2, dy2 = self._dirty
+            self._dirty = (min(dx1, x1), min(dy1, y1), max(dx2, x2), max(dy2, y2))
+
+    def _update_heat_color(self):
+        if self.max_raw <= 0:
+            return
+        if self._redraw_all:
+            x1, y1, x2, y2 = 0, 0, self.width, self.height
+        elif self._dirty is not None:
+            x1, y1, x2, y2 = self._dirty
+        else:
+            return
+
+        norm = self._norm[y1:y2, x1:x2]
+        np.multiply(self.raw[y1:y2, x1:x2], np.float32(255.0 / self.max_raw), out=norm)
+        np.copyto(self.heat_color[y1:y2, x1:x2, 2], norm, casting="unsafe")  # Red channel
+
+        self._dirty = None
+        self._redraw_all = False
+
+    def render(self, frame, out=None):
+        """
+        Blend the current heatmap onto frame. The result goes to `out` (may be frame
+        itself), or to an internal buffer reused on every call.
+        """
+        self._update_heat_color()
+        out = self.overlay if out is None else out
+        cv2.addWeighted(frame, 1.0, self.heat_color, self.alpha, 0, dst=out)
+        return out
+
+
+def warmup_frames(fade=FADE_FACTOR, level=WARMUP_LEVEL):
+    """Frames needed for heat to fade below `level`."""
+    return int(np.ceil(np.log(level) / np.log(fade)))
+
+
+def heatmap_processor(db_path, info):
+    """
+    Processor for video_pipeline: progressive heatmap overlay.
+    The gaze samples of each frame come from the world_timestamps alignment
+    index stored in the DB (see frame_index), not from frame_idx / fps.
+    """
+    gaze = load_gaze_arrays(db_path)
+    if len(gaze["ts"]) == 0:
+        raise RuntimeError("No gaze samples found in DB.")
+    xs, ys = gaze["x"], gaze["y"]
+    alignment = load_alignment(db_path)
+    gaze_start, gaze_end = alignment["gaze_start"], alignment["gaze_end"]
 
-    heatmap = np.zeros((height, width), dtype=np.float32)
     kernel = make_gaussian_kernel(KERNEL_SIZE, HEAT_INTENSITY)
+    heatmap = DecayingHeatmap(info.width, info.height, kernel)
 
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    out = cv2.VideoWriter(output_video, fourcc, fps, (width, height))
-
-    print("Generating progressive heatmap video...")
-
-    frame_idx = 0
-    gaze_index = 0
-    total_gaze = len(xs)
-
-    while frame_idx < 1000:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        frame_ts = int(frame_idx * dt_ns)
-
+    def process(frame_idx, frame):
         # DECAY existing heatmap
-        heatmap *= FADE_FACTOR
+        heatmap.decay()
 
-        # ADD gaze points for this frame
-        while gaze_index < total_gaze and gaze_ts[gaze_index] <= frame_ts:
-            gx = int(xs[gaze_index])
-            gy = int(ys[gaze_index])
-            gaze_index += 1
+        # ADD gaze points for this frame (none past the end of world_timestamps)
+        if frame_idx < len(gaze_start):
+            for gaze_index in range(gaze_start[frame_idx], gaze_end[frame_idx]):
+                gx = int(xs[gaze_index])
+                gy = int(ys[gaze_index])
 
-            if gx <= 0 or gx >= width or gy <= 0 or gy >= height:
-                continue
+                if gx <= 0 or gx >= info.width or gy <= 0 or gy >= info.height:
+                    continue
 
-            # Add Gaussian kernel centered at gaze point
-            k = kernel
-            ks = KERNEL_SIZE
-            r = ks // 2
+                # Add Gaussian kernel centered at gaze point
+                heatmap.add(gx, gy)
 
-            x1 = max(gx - r, 0)
-            x2 = min(gx + r, width)
-            y1 = max(gy - r, 0)
-            y2 = min(gy + r, height)
+        # Frames are not reused by the pipeline: blend in place
+        return heatmap.render(frame, out=frame)
 
-            kx1 = r - (gx - x1)
-            ky1 = r - (gy - y1)
-            kx2 = kx1 + (x2 - x1)
-            ky2 = ky1 + (y2 - y1)
+    return process
 
-            heatmap[y1:y2, x1:x2] += k[ky1:ky2, kx1:kx2]
 
-        # Normalize heatmap for visualization
-        hm_norm = heatmap.copy()
-        if hm_norm.max() > 0:
-            hm_norm = hm_norm / hm_norm.max()
-
-        # Convert heatmap to red overlay
-        heat_color = np.zeros((height, width, 3), dtype=np.uint8)
-        heat_color[:, :, 2] = (hm_norm * 255).astype(np.uint8)  # Red channel
-
-        overlay = cv2.addWeighted(frame, 1.0, heat_color, ALPHA, 0)
-
-        out.write(overlay)
-        frame_idx += 1
-
-    cap.release()
-    out.release()
-    print(f"Done! Heatmap video saved to: {output_video}")
+def annotate_video(input_video, output_video, db_path, segments=1, max_frames=None):
+    """
+    Progressive heatmap over the whole video.
+    Decoding, rendering and encoding run as a pipeline (see video_pipeline);
+    segments > 1 renders time chunks in parallel processes, each one starting
+    warmup_frames() early so the fading heat matches a sequential run.
+    """
+    print(f"Loading gaze data from {db_path} ...")
+    print("Generating progressive heatmap video...")
+    n_frames = process_video(input_video, output_video, heatmap_processor, (db_path,),
+                             warmup=warmup_frames(), segments=segments, max_frames=max_frames,
+                             setup=partial(load_alignment, db_path))
+    print(f"Done! Heatmap video saved to: {output_video} ({n_frames} frames)")
 
 
 if __name__ == "__main__":
@@ -1,6 +1,7 @@
 import json
 import numpy as np
 import cv2
+from video_pipeline import process_video
 
 def load_camera_calibration(json_path):
     """Load camera matrix and distortion coeffs from scene_camera.json."""
@@ -23,53 +24,109 @@ def undistort_points(points, K, D):
     und = und.reshape(-1, 2)
     return und
 
+class Undistorter:
+    """
+    Undistortion maps computed once for a (calibration, frame size) pair.
+    Each output pixel only depends on its own map entry, so a ROI of the
+    undistorted image can be obtained by slicing the maps.
+    """
+
+    def __init__(self, K, D, size, new_K=None):
+        self.K = K
+        self.D = D
+        self.size = tuple(size)  # (w, h)
+        self.new_K = K if new_K is None else new_K
+        self.map1, self.map2 = cv2.initUndistortRectifyMap(
+            K, D, np.eye(3), self.new_K, self.size, cv2.CV_16SC2
+        )
+
+    @classmethod
+    def from_json(cls, json_path, size, new_K=None):
+        K, D = load_camera_calibration(json_path)
+        return cls(K, D, size, new_K)
+
+    def frame(self, frame):
+        """Undistort the full frame."""
+        return cv2.remap(frame, self.map1, self.map2, interpolation=cv2.INTER_LINEAR)
+
+    def roi(self, frame, x0, y0, x1, y1):
+        """
+        Undistort only the [y0:y1, x0:x1] window of the undistorted image.
+        Coordinates are clipped to the frame size; None if the window is empty
+        (e.g. entirely outside the frame).
+        """
+        w, h = self.size
+        x0 = min(max(0, x0), w); x1 = min(max(0, x1), w)
+        y0 = min(max(0, y0), h); y1 = min(max(0, y1), h)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return cv2.remap(
+            frame,
+            self.map1[y0:y1, x0:x1],
+            self.map2[y0:y1, x0:x1],
+            interpolation=cv2.INTER_LINEAR,
+        )
+
+    def crop_bounds(self, cx, cy, crop_size):
+        """(x0, y0, x1, y1) of the crop_size x crop_size window centered on (cx, cy), clipped to the frame."""
+        w, h = self.size
+        half = crop_size // 2
+        x0 = min(max(0, cx - half), w); x1 = min(max(0, cx + half), w)
+        y0 = min(max(0, cy - half), h); y1 = min(max(0, cy + half), h)
+        return x0, y0, x1, y1
+
+    def crop_around(self, frame, cx, cy, crop_size):
+        """
+        Undistorted crop_size x crop_size window centered on (cx, cy), with its bounds
+        clipped to the frame. None if the window does not overlap the frame.
+        """
+        x0, y0, x1, y1 = self.crop_bounds(cx, cy, crop_size)
+        crop = self.roi(frame, x0, y0, x1, y1)
+        if crop is None:
+            return None
+        return crop, (x0, y0, x1, y1)
+
+    def points(self, points):
+        """Undistort 2D points into the same image space as the maps."""
+        src = np.array(points, dtype=np.float64).reshape(-1, 1, 2)
+        return cv2.undistortPoints(src, self.K, self.D, P=self.new_K).reshape(-1, 2)
+
+
+_UNDISTORTERS = {}
+
+def get_undistorter(K, D, size):
+    """Return the cached Undistorter for this calibration and frame size."""
+    key = (K.tobytes(), D.tobytes(), tuple(size))
+    if key not in _UNDISTORTERS:
+        _UNDISTORTERS[key] = Undistorter(K, D, size)
+    return _UNDISTORTERS[key]
+
 def undistort_frame(frame, K, D):
     """
     Undistort a single frame using OpenCV fisheye model.
     Supports 8-coefficient distortion (as in Pupil Labs calibration).
+    Maps are computed once per calibration and frame size.
     """
     h, w = frame.shape[:2]
-    map1, map2 = cv2.initUndistortRectifyMap(K, D, np.eye(3), K, (w, h), cv2.CV_16SC2)
-
-    # Apply remapping
-    undistorted = cv2.remap(frame, map1, map2, interpolation=cv2.INTER_LINEAR)
-    
-    return undistorted
-
-def undistort_video(camera_file, input_video, output_video, db_path):
-    cap = cv2.VideoCapture(input_video)
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    dt_ns = 1e9 / fps
-
-    width  = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    out = cv2.VideoWriter(output_video, fourcc, fps, (width, height))
+    return get_undistorter(K, D, (w, h)).frame(frame)
 
-    print("Generating undistorted video...")
-    
+def undistort_processor(camera_file, info):
+    """Processor for video_pipeline: full-frame undistortion."""
     K, D = load_camera_calibration(camera_file)
+    size = (info.width, info.height)
     # Precompute mapping ONCE (much faster)
-    ret, test_frame = cap.read()
-    h, w = test_frame.shape[:2]
-    new_K, roi = cv2.getOptimalNewCameraMatrix(K, D, (w, h), 0.0, (w, h))
-    map1, map2 = cv2.initUndistortRectifyMap(K, D, None, new_K, (w, h), cv2.CV_16SC2)
-
-    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)  # restart video
-
-    frame_idx = 0
-    while frame_idx < 1000:
-        frame_idx += 1
-        ret, frame = cap.read()
-        if not ret:
-            break
+    new_K, roi = cv2.getOptimalNewCameraMatrix(K, D, size, 0.0, size)
+    undistorter = Undistorter(K, D, size, new_K)
+    return lambda frame_idx, frame: undistorter.frame(frame)
 
-        undistorted = cv2.remap(frame, map1, map2, cv2.INTER_LINEAR)
-        out.write(undistorted)
-
-    cap.release()
-    out.release()
+def undistort_video(camera_file, input_video, output_video, db_path, segments=1, max_frames=None):
+    """
+    Undistort the whole video. Decoding, remapping and encoding run as a pipeline
+    (see video_pipeline); segments > 1 renders time chunks in parallel processes.
+    """
+    print("Generating undistorted video...")
+    process_video(input_video, output_video, undistort_processor, (camera_file,),
+                  segments=segments, max_frames=max_frames)
     print("Saved undistorted video ✔")
 
 
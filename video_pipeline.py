@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+import cv2
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+
+# Frames buffered between stages (decode -> process -> encode)
+QUEUE_SIZE = 16
+FOURCC = "mp4v"
+
+_END = object()
+
+
+@dataclass
+class VideoInfo:
+    fps: float
+    width: int
+    height: int
+    frame_count: int  # as reported by the container, may be 0 or approximate
+
+
+def read_video_info(input_video):
+    cap = cv2.VideoCapture(input_video)
+    if not cap.isOpened():
+        raise RuntimeError(f"Cannot open video: {input_video}")
+    info = VideoInfo(
+        fps=cap.get(cv2.CAP_PROP_FPS),
+        width=int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        height=int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        frame_count=int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+    )
+    cap.release()
+    return info
+
+
+def _put(q, item, stop):
+    """Blocking put that gives up once another stage has failed."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q, stop):
+    while True:
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set():
+                return _END
+
+
+def run_pipeline(input_video, output_video, processor_factory, factory_args=(),
+                 start_frame=0, end_frame=None, warmup=0, queue_size=QUEUE_SIZE):
+    """
+    Decode, process and encode [start_frame, end_frame) of input_video into output_video.
+    Decoding and encoding run in their own threads (OpenCV releases the GIL), connected
+    to the processing stage by bounded queues, so the three stages overlap.
+
+    processor_factory(*factory_args, info) must return process(frame_idx, frame) -> frame.
+    The processor may modify and return the frame it receives, which is not reused.
+    warmup: frames before start_frame fed to the processor but not written, so that
+    stateful processors (e.g. a decaying heatmap) reach the right state mid-video.
+    Returns the number of frames written.
+    """
+    info = read_video_info(input_video)
+    process = processor_factory(*factory_args, info)
+
+    cap = cv2.VideoCapture(input_video)
+    first = max(0, start_frame - warmup)
+    if first > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+    out = cv2.VideoWriter(output_video, cv2.VideoWriter_fourcc(*FOURCC), info.fps, (info.width, info.height))
+
+    decoded = queue.Queue(maxsize=queue_size)
+    processed = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    written = [0]
+
+    def decode():
+        try:
+            frame_idx = first
+            while end_frame is None or frame_idx < end_frame:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                if not _put(decoded, (frame_idx, frame), stop):
+                    return
+                frame_idx += 1
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(decoded, _END, stop)
+
+    def encode():
+        try:
+            while True:
+                item = _get(processed, stop)
+                if item is _END:
+                    return
+                out.write(item)
+                written[0] += 1
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [threading.Thread(target=decode, daemon=True), threading.Thread(target=encode, daemon=True)]
+    for t in threads:
+        t.start()
+    try:
+        while True:
+            item = _get(decoded, stop)
+            if item is _END:
+                break
+            frame_idx, frame = item
+            result = process(frame_idx, frame)
+            if frame_idx >= start_frame and not _put(processed, result, stop):
+                break
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        _put(processed, _END, stop)
+        for t in threads:
+            t.join()
+        cap.release()
+        out.release()
+
+    if errors:
+        raise errors[0]
+    return written[0]
+
+
+def _segment_bounds(frame_count, segments):
+    bounds = [frame_count * i // segments for i in range(segments + 1)]
+    return [(bounds[i], bounds[i + 1] if i < segments - 1 else None) for i in range(segments)]
+
+
+def concat_videos(parts, output_video, fps, size):
+    """Concatenate video files with the same codec and size (stream copy with ffmpeg when available)."""
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is not None:
+        list_file = output_video + ".parts.txt"
+        with open(list_file, "w") as f:
+            for part in parts:
+                f.write(f"file '{os.path.abspath(part)}'\n")
+        try:
+            subprocess.run([ffmpeg, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0",
+                            "-i", list_file, "-c", "copy", output_video], check=True)
+            return
+        finally:
+            os.remove(list_file)
+
+    # Fallback: decode and re-encode the segments one after the other
+    out = cv2.VideoWriter(output_video, cv2.VideoWriter_fourcc(*FOURCC), fps, size)
+    for part in parts:
+        cap = cv2.VideoCapture(part)
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            out.write(frame)
+        cap.release()
+    out.release()
+
+
+def process_video(input_video, output_video, processor_factory, factory_args=(), warmup=0,
+                  segments=1, max_frames=None, queue_size=QUEUE_SIZE, setup=None):
+    """
+    Run processor_factory's processor over the whole video (see run_pipeline).
+    segments > 1: the video is split into time chunks rendered by separate processes
+    (processor_factory must then be a module-level function with picklable arguments),
+    each chunk starting `warmup` frames early, and the chunks are concatenated.
+    max_frames: only process the first max_frames frames (None = whole video).
+    setup: called once in this process before any frame is processed, e.g. to build an
+    on-disk index the processors read, instead of every segment process building it at once.
+    """
+    if setup is not None:
+        setup()
+    info = read_video_info(input_video)
+    if segments <= 1 or info.frame_count <= 0:
+        return run_pipeline(input_video, output_video, processor_factory, factory_args,
+                            end_frame=max_frames, warmup=warmup, queue_size=queue_size)
+
+    frame_count = info.frame_count if max_frames is None else min(max_frames, info.frame_count)
+    bounds = _segment_bounds(frame_count, segments)
+    if max_frames is not None:
+        bounds[-1] = (bounds[-1][0], frame_count)
+
+    tmp_dir = tempfile.mkdtemp(prefix="segments-", dir=os.path.dirname(os.path.abspath(output_video)))
+    ext = os.path.splitext(output_video)[1] or ".mp4"
+    parts = [os.path.join(tmp_dir, f"{i:04d}{ext}") for i in range(len(bounds))]
+    try:
+        # spawn: a forked child can deadlock on OpenCV's thread pool inherited from the parent
+        with ProcessPoolExecutor(max_workers=segments, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [
+                pool.submit(run_pipeline, input_video, part, processor_factory, factory_args,
+                            start, end, warmup, queue_size)
+                for part, (start, end) in zip(parts, bounds)
+            ]
+            written = sum(f.result() for f in futures)
+        concat_videos(parts, output_video, info.fps, (info.width, info.height))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return written